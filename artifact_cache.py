@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+
+class ArtifactCache:
+    """On-disk cache of per-job artifacts keyed by job id and artifact name.
+
+    Every entry is stored as <path>/<job_id>/<name> with validators (ETag, Last-Modified)
+    in a .meta file next to it. Reading an entry refreshes its mtime, when total size
+    exceeds max_bytes least recently used entries are removed.
+    """
+
+    META_SUFFIX = ".meta"
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+
+    def _entry_path(self, job_id, name: str) -> str:
+        return os.path.join(self.path, str(job_id), name.replace("/", "_"))
+
+    def get(self, job_id, name: str):
+        """Return (content, meta) of cached artifact or (None, {}) when it is not cached"""
+        entry = self._entry_path(job_id, name)
+        with self._lock:
+            try:
+                with open(entry, "rb") as content_file:
+                    content = content_file.read()
+                os.utime(entry)
+            except FileNotFoundError:
+                return None, {}
+            try:
+                with open(entry + self.META_SUFFIX) as meta_file:
+                    meta = json.load(meta_file)
+            except (FileNotFoundError, ValueError):
+                meta = {}
+        return content, meta
+
+    def open(self, job_id, name: str):
+        """Return (binary file, meta) of cached artifact or (None, {}), caller closes the file"""
+        entry = self._entry_path(job_id, name)
+        with self._lock:
+            try:
+                content_file = open(entry, "rb")
+                os.utime(entry)
+            except FileNotFoundError:
+                return None, {}
+            try:
+                with open(entry + self.META_SUFFIX) as meta_file:
+                    meta = json.load(meta_file)
+            except (FileNotFoundError, ValueError):
+                meta = {}
+        return content_file, meta
+
+    def put(self, job_id, name: str, content: bytes, meta: dict = None) -> None:
+        with self.writer(job_id, name, meta) as content_file:
+            content_file.write(content)
+
+    @contextmanager
+    def writer(self, job_id, name: str, meta: dict = None):
+        """Yield binary file for content of entry, it replaces cached one only when block succeeds"""
+        entry = self._entry_path(job_id, name)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        # write to temporary file first so concurrent processes never read half of artifact
+        tmp_entry = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_entry, "wb") as content_file:
+                yield content_file
+        except BaseException:
+            os.remove(tmp_entry)
+            raise
+        with self._lock:
+            self._scan()
+            self._size -= self._entry_size(entry)
+            os.replace(tmp_entry, entry)
+            with open(entry + self.META_SUFFIX, "w") as meta_file:
+                json.dump(meta or {}, meta_file)
+            self._size += self._entry_size(entry)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entry_size(self, entry: str) -> int:
+        size = 0
+        for file_path in (entry, entry + self.META_SUFFIX):
+            try:
+                size += os.path.getsize(file_path)
+            except FileNotFoundError:
+                pass
+        return size
+
+    def _entries(self):
+        """Yield (mtime, entry path) for every cached artifact"""
+        if not os.path.isdir(self.path):
+            return
+        for job_dir in os.scandir(self.path):
+            if not job_dir.is_dir():
+                continue
+            for artifact in os.scandir(job_dir.path):
+                if not artifact.name.endswith((self.META_SUFFIX, ".tmp")):
+                    yield artifact.stat().st_mtime, artifact.path
+
+    def _scan(self) -> None:
+        if self._size is None:
+            self._size = sum(self._entry_size(entry) for _, entry in self._entries())
+
+    def _evict(self) -> None:
+        # keep some headroom so not every following put triggers whole directory scan
+        target = self.max_bytes * 0.9
+        for _, entry in sorted(self._entries()):
+            if self._size <= target:
+                break
+            self._size -= self._entry_size(entry)
+            for file_path in (entry, entry + self.META_SUFFIX):
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+            try:
+                os.rmdir(os.path.dirname(entry))
+            except OSError:
+                pass
@@ -0,0 +1,696 @@
+#!/usr/bin/python3
+import argparse
+import collections
+import gc
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from models import JobSQL
+from myutils import BUGREF_PATTERN
+
+
+class LegacyJobSQL:
+    """JobSQL as it was before slots and interning, kept only for comparison"""
+
+    def __init__(self, raw_job):
+        self.id = raw_job[0]
+        self.name = raw_job[1]
+        self.result = raw_job[2]
+        self.state = raw_job[3]
+        self.flavor = raw_job[4]
+        self.arch = raw_job[5]
+        self.build = raw_job[6]
+        self.groupid = raw_job[7]
+        self.version = raw_job[8]
+        self.machine = raw_job[9]
+        self.pattern = "Job(id: {}, name: {}, result: {}, state: {}, flavor: {}, arch: {}, build: {}, groupid: {}, version: {}, machine: {})"
+
+
+def synthetic_rows(count: int, seed: int = 0) -> list:
+    """Rows shaped like JobSQL.SELECT_QUERY output.
+
+    Every row carries its own string objects, the same way psycopg2 returns them.
+    """
+    rnd = random.Random(seed)
+    tests = [f"publiccloud_test_{i}" for i in range(300)]
+    results = ["passed", "failed", "softfailed", "incomplete", "timeout_exceeded"]
+    flavors = ["EC2-BYOS", "AZURE-Basic", "GCE-Updates", "Azure-Image-Updates"]
+    arches = ["x86_64", "aarch64"]
+    versions = ["15-SP4", "15-SP5", "15-SP6", "12-SP5"]
+    machines = ["az_Standard_A2_v2", "ec2_t3.large", "gce_n1_standard_2"]
+    builds = [f"2024{i:04d}-1" for i in range(50)]
+    rows = []
+    for job_id in range(1, count + 1):
+        rows.append(
+            (
+                10_000_000 + job_id,
+                _fresh(rnd.choice(tests)),
+                _fresh(rnd.choice(results)),
+                _fresh("done"),
+                _fresh(rnd.choice(flavors)),
+                _fresh(rnd.choice(arches)),
+                _fresh(rnd.choice(builds)),
+                430,
+                _fresh(rnd.choice(versions)),
+                _fresh(rnd.choice(machines)),
+            )
+        )
+    return rows
+
+
+def _fresh(value: str) -> str:
+    return value.encode().decode()
+
+
+def measure(label: str, count: int, build):
+    """Time construction of records and memory they keep once cursor rows are released"""
+    # best of three, single run swings with cyclic GC passes hitting it
+    elapsed = float("inf")
+    for _ in range(3):
+        rows = synthetic_rows(count)
+        gc.collect()
+        started = time.perf_counter()
+        jobs = build(rows)
+        elapsed = min(elapsed, time.perf_counter() - started)
+        del rows, jobs
+    # tracing slows allocation down a lot, so memory is measured in separate pass
+    gc.collect()
+    tracemalloc.start()
+    rows = synthetic_rows(count)
+    jobs = build(rows)
+    del rows
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<20} {elapsed:8.3f}s {current / 2**20:10.1f} MiB {peak / 2**20:10.1f} MiB")
+    del jobs
+
+
+def bench_jobsql(args):
+    print(f"{args.rows} rows")
+    print(f"{'variant':<20} {'build':>9} {'retained':>14} {'peak':>14}")
+    measure("legacy class", args.rows, lambda rows: [LegacyJobSQL(row) for row in rows])
+    measure("JobSQL()", args.rows, lambda rows: [JobSQL(row) for row in rows])
+    measure("JobSQL.from_rows", args.rows, JobSQL.from_rows)
+
+
+class FakeOpenQA(ThreadingHTTPServer):
+    """Local stand-in for openQA HTTP API with fixed latency per request.
+
+    Serves group_overview, job comments, job details, results.json and vars.json of
+    jobs seeded by seed_osd and accepts comment/job writes. Requests are counted per
+    endpoint so benchmarks can report them. Server can be made to push back: error_rate
+    of requests is answered with 503 and requests above capacity in flight with 429.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, latency: float, ltp_tests: int = 2000, error_rate: float = 0, capacity: int = 0):
+        super().__init__(("127.0.0.1", 0), FakeOpenQAHandler)
+        self.latency = latency
+        self.ltp_tests = ltp_tests
+        self.error_rate = error_rate
+        self.capacity = capacity
+        self.in_flight = 0
+        self.random = random.Random(0)
+        self.build = "20240101-1"
+        self.comments = collections.defaultdict(list)
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/"
+
+    def ltp_results(self, job_id: int) -> dict:
+        rnd = random.Random(job_id)
+        return {
+            "environment": {"kernel": "5.14.21", "ltp_version": "20240129"},
+            "results": [
+                {
+                    "test_fqn": f"LTP:syscalls:test{i}",
+                    "status": "fail" if rnd.random() < 0.01 else "pass",
+                    "environment": {},
+                    "test": {"duration": 0.5, "result": "TPASS"},
+                }
+                for i in range(self.ltp_tests)
+            ],
+        }
+
+
+class FakeOpenQAHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, without this delayed ACK adds ~40ms per request
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, code: int, data=None):
+        body = json.dumps(data).encode() if data is not None else b""
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        server = self.server
+        time.sleep(server.latency)
+        path = self.path.split("?")[0]
+        if m := re.fullmatch(r"/group_overview/(\d+)\.json", path):
+            return "group_overview", 200, {
+                "build_results": [{"build": server.build}],
+                "group": {"name": f"group {m.group(1)}"},
+            }
+        if m := re.fullmatch(r"/api/v1/jobs/(\d+)/comments", path):
+            job_id = int(m.group(1))
+            if self.command == "POST":
+                text = parse_qs(urlsplit(self.path).query).get("text", [""])[0]
+                with server.lock:
+                    comment_id = sum(len(c) for c in server.comments.values()) + 1
+                    server.comments[job_id].append(
+                        {"id": comment_id, "text": text, "bugrefs": BUGREF_PATTERN.findall(text), "userName": "bench"}
+                    )
+                return "post_comment", 200, {"id": comment_id}
+            with server.lock:
+                comments = list(server.comments[job_id])
+            return "comments", 200, comments
+        if m := re.fullmatch(r"/api/v1/jobs/(\d+)/comments/(\d+)", path):
+            with server.lock:
+                comments = server.comments[int(m.group(1))]
+                comments[:] = [c for c in comments if c["id"] != int(m.group(2))]
+            return "delete_comment", 200, {}
+        if m := re.fullmatch(r"/api/v1/jobs/(\d+)", path):
+            if self.command == "DELETE":
+                return "delete_job", 200, {}
+            return "job", 200, {"job": self.job_details(int(m.group(1)))}
+        if path == "/api/v1/jobs" and "ids=" in self.path:
+            ids = self.path.split("ids=", 1)[1].split("&")[0].replace("%2C", ",").split(",")
+            return "jobs", 200, {"jobs": [self.job_details(int(job_id)) for job_id in ids]}
+        if m := re.fullmatch(r"/tests/(\d+)/file/results\.json", path):
+            return "results.json", 200, server.ltp_results(int(m.group(1)))
+        if m := re.fullmatch(r"/tests/(\d+)/file/vars\.json", path):
+            return "vars.json", 200, {"TEST": "publiccloud_ltp", "INCIDENT_TEST_REPOS": "a,b,c"}
+        return "unknown", 404, {"error": "not found"}
+
+    @staticmethod
+    def job_details(job_id: int) -> dict:
+        return {
+            "id": job_id,
+            "t_started": f"2024-01-01T10:{job_id % 60:02d}:00",
+            "settings": {
+                "VERSION": ["15-SP4", "15-SP5"][job_id % 2],
+                "FLAVOR": "EC2-BYOS",
+                "ARCH": "x86_64",
+                "PUBLIC_CLOUD_REGION": ["eu-central-1", "us-east-1", "eu-west-1"][job_id % 3],
+            },
+        }
+
+    def _handle(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        with server.lock:
+            server.in_flight += 1
+            overloaded = server.capacity and server.in_flight > server.capacity
+            failing = server.random.random() < server.error_rate
+        try:
+            if overloaded or failing:
+                time.sleep(server.latency)
+                with server.lock:
+                    server.counts["rejected"] += 1
+                self._reply(429 if overloaded else 503, {"error": "busy"})
+                return
+            endpoint, code, data = self._route()
+            with server.lock:
+                server.counts[endpoint] += 1
+            self._reply(code, data)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    do_GET = _handle
+    do_POST = _handle
+    do_DELETE = _handle
+
+
+BENCH_GROUP = 430
+MODULES = [f"module_{i}" for i in range(20)]
+
+
+def seed_osd(path: str, jobs_count: int, build: str):
+    """SQLite stand-in for OSD with jobs_count jobs of one build in BENCH_GROUP.
+
+    Every scenario has two jobs (original and retry), half of jobs failed with couple
+    of failed modules, every tenth scenario is publiccloud_ltp.
+    """
+    from osd_mirror import OSDMirror
+
+    mirror = OSDMirror(path, logging.getLogger("bench"))
+    rnd = random.Random(jobs_count)
+    now = str(datetime.now())
+    jobs = []
+    modules = []
+    for job_id in range(1, jobs_count + 1):
+        scenario = (job_id - 1) // 2
+        test = "publiccloud_ltp" if scenario % 10 == 0 else f"test_{scenario % 150}"
+        result = "failed" if rnd.random() < 0.5 else "passed"
+        jobs.append(
+            (
+                job_id,
+                test,
+                result,
+                "done",
+                ["EC2-BYOS", "AZURE-Basic", "GCE-Updates"][scenario % 3],
+                ["x86_64", "aarch64"][scenario % 2],
+                build,
+                BENCH_GROUP,
+                ["15-SP4", "15-SP5"][scenario % 2],
+                f"machine_{scenario}",
+                now,
+            )
+        )
+        failed = set(rnd.sample(MODULES, 2)) if result == "failed" else set()
+        modules.extend((job_id, name, "failed" if name in failed else "passed") for name in MODULES)
+    mirror.connection.executemany("insert into jobs values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", jobs)
+    mirror.connection.executemany("insert into job_modules values (?, ?, ?)", modules)
+    mirror.connection.execute("insert into sync_state values ('last_seen', ?)", (jobs_count,))
+    mirror.connection.commit()
+    return mirror
+
+
+def bench_tools(args):
+    from myutils import TaskHelper
+    from artifact_cache import ArtifactCache
+    from geeckotest_killer import Killer
+    from ltp_analysis import LTPAnalyze
+    from bugref_index import BugrefIndex
+
+    # tools configure logging on their own, keep benchmark output readable
+    logging.basicConfig(level=logging.WARNING)
+    server = FakeOpenQA(args.latency / 1000, args.ltp_tests, args.error_rate, args.capacity)
+    TaskHelper.OPENQA_URL_BASE = server.url
+    Killer.OPENQA_API_BASE = f"{server.url}api/v1/"
+    workdir = tempfile.mkdtemp(prefix="openqa-review-bench-")
+    print(f"fake openQA at {server.url}, latency {args.latency}ms")
+    print(f"{'benchmark':<16} {'jobs':>7} {'time':>9} {'jobs/s':>10} {'SQL':>6} {'HTTP':>6}")
+
+    def run(label: str, jobs_count: int, helper, action):
+        server.counts.clear()
+        queries_before = helper.query_count
+        started = time.perf_counter()
+        action()
+        elapsed = time.perf_counter() - started
+        print(
+            f"{label:<16} {jobs_count:>7} {elapsed:8.3f}s {jobs_count / elapsed:10.1f} "
+            f"{helper.query_count - queries_before:>6} {sum(server.counts.values()):>6}"
+        )
+        return dict(server.counts)
+
+    for jobs_count in args.sizes:
+        mirror = seed_osd(os.path.join(workdir, f"osd_{jobs_count}.sqlite"), jobs_count, server.build)
+        # every size starts with cold artifact cache and no comments
+        TaskHelper._artifact_cache = ArtifactCache(os.path.join(workdir, f"cache_{jobs_count}"), 2**34)
+        server.comments.clear()
+        killer = Killer(BENCH_GROUP, dryrun=False, latest_build=server.build)
+        killer.mirror = mirror
+        run("label_by_module", jobs_count, killer, lambda: killer.label_by_module("module_1*", "bsc#1234"))
+        # cron re-run, every job already carries the comment
+        run("label again", jobs_count, killer, lambda: killer.label_by_module("module_1*", "bsc#1234"))
+        run("get_all_labels", jobs_count, killer, killer.get_all_labels)
+        killer._bugref_index = BugrefIndex(
+            os.path.join(workdir, f"index_{jobs_count}.sqlite"), logging.getLogger("bench")
+        )
+        run("index update", jobs_count, killer, lambda: killer.bugref_index().update(killer, [BENCH_GROUP]))
+        killer.use_index = True
+        run("index labels", jobs_count, killer, killer.get_all_labels)
+        killer.use_index = False
+        killer.bugref_index().close()
+        query_args = argparse.Namespace(
+            query="result=failed",
+            delete=False,
+            restart=False,
+            comment="bsc#4321",
+            delete_comment=False,
+            params=[],
+        )
+        run("get_jobs_by", jobs_count, killer, lambda: killer.get_jobs_by(query_args))
+        # deprecated raw SQL fragments with LIKE patterns must keep working
+        raw_args = argparse.Namespace(**{**vars(query_args), "query": "and test like '%ltp%'", "comment": None})
+        if not killer.get_jobs_by(raw_args):
+            raise RuntimeError("raw SQL --query with LIKE pattern found no jobs")
+        ltp = LTPAnalyze()
+        ltp.mirror = mirror
+        run("ltp_analyze", jobs_count, ltp, ltp.analyze)
+        run("ltp_analyze warm", jobs_count, ltp, ltp.analyze)
+        mirror.close()
+    shutil.rmtree(workdir)
+
+
+def write_ltp_results(path: str, size_mb: int) -> int:
+    """Synthetic results.json of at least size_mb, returns number of test cases"""
+    rnd = random.Random(size_mb)
+    count = 0
+    with open(path, "w") as results_file:
+        results_file.write('{"environment": {"kernel": "5.14.21"}, "results": [')
+        while results_file.tell() < size_mb * 2**20:
+            case = {
+                "test_fqn": f"LTP:syscalls:test{count}",
+                "status": "fail" if rnd.random() < 0.01 else "pass",
+                "environment": {},
+                "test": {"duration": rnd.random(), "result": "TPASS", "log": "x" * rnd.randint(50, 500)},
+            }
+            results_file.write(("," if count else "") + json.dumps(case))
+            count += 1
+        results_file.write('], "format": "result-array:v2"}')
+    return count
+
+
+def bench_ltpjson(args):
+    from json_stream import iter_array_items, iter_file_chunks
+    from ltp_analysis import failed_test_fqn
+
+    workdir = tempfile.mkdtemp(prefix="openqa-review-bench-")
+    path = os.path.join(workdir, "results.json")
+    cases = write_ltp_results(path, args.size_mb)
+    print(f"{os.path.getsize(path) / 2**20:.1f} MiB, {cases} test cases")
+    print(f"{'variant':<20} {'time':>9} {'failed':>8} {'peak':>14}")
+
+    def whole_document():
+        with open(path, "rb") as results_file:
+            document = json.load(results_file)
+        return [case["test_fqn"] for case in document["results"] if case["status"] == "fail"]
+
+    def streaming():
+        with open(path, "rb") as results_file:
+            items = iter_array_items(iter_file_chunks(results_file), "results")
+            return [fqn for fqn in map(failed_test_fqn, items) if fqn is not None]
+
+    for label, parse in (("json.load", whole_document), ("streaming", streaming)):
+        gc.collect()
+        started = time.perf_counter()
+        failed = parse()
+        elapsed = time.perf_counter() - started
+        # tracing slows allocation down a lot, so memory is measured in separate pass
+        gc.collect()
+        tracemalloc.start()
+        parse()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{label:<20} {elapsed:8.3f}s {len(failed):>8} {peak / 2**20:10.1f} MiB")
+    shutil.rmtree(workdir)
+
+
+class LegacyFailedModule:
+    """ltp_analysis.FailedModule as it was before columnar matrix, kept only for comparison"""
+
+    def __init__(self) -> None:
+        self.modules = collections.defaultdict(
+            lambda: {
+                "arches": set(),
+                "flavors": set(),
+                "job_ids": set(),
+                "machines": set(),
+                "versions": set(),
+            }
+        )
+
+    def append(self, name: str, job: JobSQL):
+        m = self.modules[name]
+        m["arches"].add(job.arch)
+        m["flavors"].add(job.flavor)
+        m["job_ids"].add(job.id)
+        m["machines"].add(job.machine)
+        m["versions"].add(job.version)
+
+
+def synthetic_ltp_failures(jobs_count: int, cases: int = 5000) -> list:
+    """(job, failed test cases) of LTP jobs, few cases fail in most jobs and long tail rarely"""
+    rnd = random.Random(jobs_count)
+    jobs = JobSQL.from_rows(synthetic_rows(jobs_count))
+    return [
+        (job, {f"LTP:syscalls:test{int(rnd.paretovariate(1.2)) % cases}" for _ in range(rnd.randint(0, 40))})
+        for job in jobs
+    ]
+
+
+def bench_ltpmatrix(args):
+    from ltp_analysis import FailureMatrix
+
+    failures = synthetic_ltp_failures(args.jobs)
+    print(f"{args.jobs} jobs, {sum(len(names) for _, names in failures)} failed test cases")
+    print(f"{'variant':<20} {'build':>9} {'reports':>9} {'retained':>14}")
+
+    def legacy():
+        ranged = LegacyFailedModule()
+        for job, names in failures:
+            for name in names:
+                ranged.append(name, job)
+        return ranged
+
+    def legacy_reports(ranged):
+        # the old report was one log line per module with all of its sets
+        return [f"Module: {name} : {ranged.modules[name]}" for name in ranged.modules]
+
+    def columnar():
+        matrix = FailureMatrix()
+        for job, names in failures:
+            matrix.add_job(job, names)
+        return matrix
+
+    def columnar_reports(matrix):
+        return matrix.top(20), matrix.module_by("arch"), matrix.rate_by("flavor")
+
+    for label, build, reports in (
+        ("set of sets", legacy, legacy_reports),
+        ("FailureMatrix", columnar, columnar_reports),
+    ):
+        gc.collect()
+        started = time.perf_counter()
+        aggregate = build()
+        built = time.perf_counter() - started
+        started = time.perf_counter()
+        reports(aggregate)
+        reported = time.perf_counter() - started
+        del aggregate
+        # tracing slows allocation down a lot, so memory is measured in separate pass
+        gc.collect()
+        tracemalloc.start()
+        aggregate = build()
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del aggregate
+        print(f"{label:<20} {built:8.3f}s {reported:8.3f}s {current / 2**20:10.1f} MiB")
+
+
+def synthetic_module_runs(builds: int, scenarios: int):
+    """Module result rows ordered by job id, one job per scenario and build.
+
+    Every tenth series fails randomly in 30% of runs, every fiftieth starts failing for
+    good in the middle of history, the rest fails rarely.
+    """
+    rnd = random.Random(builds * scenarios)
+    job_id = 0
+    for build_number in range(builds):
+        build = f"2024{build_number:04d}"
+        for scenario in range(scenarios):
+            job_id += 1
+            for module_number, module in enumerate(MODULES):
+                series = scenario * len(MODULES) + module_number
+                if series % 10 == 0:
+                    failed = rnd.random() < 0.3
+                elif series % 50 == 1:
+                    failed = build_number >= builds // 2
+                else:
+                    failed = rnd.random() < 0.01
+                yield (
+                    job_id,
+                    build,
+                    BENCH_GROUP,
+                    f"test_{scenario}",
+                    "x86_64",
+                    "EC2-BYOS",
+                    "15-SP5",
+                    f"machine_{scenario}",
+                    module,
+                    "failed" if failed else "passed",
+                )
+
+
+def legacy_flaky_stats(runs: list) -> tuple:
+    """flips, longest failure streak and current failure streak by walking every run"""
+    flips = longest = streak = 0
+    for previous, current in zip([None] + runs, runs):
+        if previous is not None and previous != current:
+            flips += 1
+        streak = streak + 1 if current == "failed" else 0
+        longest = max(longest, streak)
+    return flips, longest, streak
+
+
+def bench_flakiness(args):
+    from flakiness import FlakySnapshot, build_snapshot
+
+    rows = list(synthetic_module_runs(args.builds, args.scenarios))
+    workdir = tempfile.mkdtemp(prefix="openqa-review-bench-")
+    path = os.path.join(workdir, "flakiness.snapshot")
+    print(f"{args.builds} builds x {args.scenarios} scenarios x {len(MODULES)} modules = {len(rows)} module runs")
+    print(f"{'variant':<20} {'build':>9} {'open':>9} {'all stats':>10} {'retained':>14}")
+
+    def legacy():
+        history = collections.defaultdict(list)
+        for job_id, build, group_id, test, arch, flavor, version, machine, module, result in rows:
+            history[(group_id, test, arch, flavor, version, machine, module)].append(result)
+        return history
+
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    history = legacy()
+    built = time.perf_counter() - started
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    started = time.perf_counter()
+    legacy_stats = {key: legacy_flaky_stats(runs) for key, runs in history.items()}
+    computed = time.perf_counter() - started
+    print(f"{'dict of lists':<20} {built:8.3f}s {'-':>9} {computed:9.3f}s {current / 2**20:10.1f} MiB")
+    del history
+
+    started = time.perf_counter()
+    build_snapshot(iter(rows), path)
+    built = time.perf_counter() - started
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    snapshot = FlakySnapshot(path)
+    opened = time.perf_counter() - started
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    started = time.perf_counter()
+    stats = list(snapshot.iter_stats())
+    computed = time.perf_counter() - started
+    print(f"{'snapshot':<20} {built:8.3f}s {opened:8.3f}s {computed:9.3f}s {current / 2**20:10.1f} MiB")
+    snapshot_stats = {
+        (*s.scenario, s.module): (s.flips, s.longest_streak, s.current_streak) for s in stats
+    }
+    if snapshot_stats != legacy_stats:
+        raise RuntimeError("snapshot statistics differ from walking every run")
+    verdicts = collections.Counter(
+        snapshot.classify(s.scenario, s.module)[0] for s in stats
+    )
+    print(f"snapshot file {os.path.getsize(path) / 2**20:.1f} MiB, verdicts {dict(verdicts)}")
+    snapshot.close()
+    shutil.rmtree(workdir)
+
+
+ENTRY_POINTS = [
+    "geeckotest_killer",
+    "ltp_analysis",
+    "comments_cleaner",
+    "force_softfailure",
+    "log_reg_failure",
+    "download_image",
+    "review_daemon",
+    "bugref_index",
+    "flakiness",
+]
+# must not be loaded just by importing a script
+HEAVY_MODULES = ["psycopg2", "requests", "urllib3"]
+
+
+def import_time(module: str) -> tuple[float, list]:
+    """Cumulative import time of module in fresh interpreter and heavy modules it pulled in"""
+    check = f"import sys, {module}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", check],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    for line in completed.stderr.splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000, completed.stdout.split()
+    raise RuntimeError(f"No import time reported for {module}")
+
+
+def bench_importtime(args):
+    print(f"{'entry point':<20} {'import ms':>10}  heavy modules")
+    failed = []
+    for module in args.modules:
+        # median of several runs, single run swings by tens of ms on busy machine
+        results = [import_time(module) for _ in range(args.repeat)]
+        millis = statistics.median(result[0] for result in results)
+        heavy = sorted({name for result in results for name in result[1]})
+        print(f"{module:<20} {millis:>10.1f}  {' '.join(heavy) or '-'}")
+        if millis > args.budget or heavy:
+            failed.append(module)
+    if failed:
+        print(f"over {args.budget}ms budget or importing heavy modules: {', '.join(failed)}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    jobsql = subparsers.add_parser("jobsql", help="memory and construction time of job records")
+    jobsql.add_argument("--rows", type=int, default=500_000)
+    jobsql.set_defaults(func=bench_jobsql)
+    tools = subparsers.add_parser(
+        "tools", help="killer and LTP analysis against local fake openQA and OSD"
+    )
+    tools.add_argument("--sizes", type=int, nargs="+", default=[200, 1000, 5000])
+    tools.add_argument("--latency", type=float, default=5, help="fake openQA latency in ms")
+    tools.add_argument("--ltp-tests", type=int, default=2000, help="test cases per results.json")
+    tools.add_argument("--error-rate", type=float, default=0, help="share of requests answered with 503")
+    tools.add_argument("--capacity", type=int, default=0, help="requests in flight above which 429 is answered")
+    tools.set_defaults(func=bench_tools)
+    ltpjson = subparsers.add_parser(
+        "ltpjson", help="whole document versus streaming parse of large results.json"
+    )
+    ltpjson.add_argument("--size-mb", type=int, default=50)
+    ltpjson.set_defaults(func=bench_ltpjson)
+    ltpmatrix = subparsers.add_parser(
+        "ltpmatrix", help="aggregation of LTP failures into reports, set of sets versus columnar"
+    )
+    ltpmatrix.add_argument("--jobs", type=int, default=50_000)
+    ltpmatrix.set_defaults(func=bench_ltpmatrix)
+    flakiness = subparsers.add_parser(
+        "flakiness", help="module history as dict of lists versus memory mapped snapshot"
+    )
+    flakiness.add_argument("--builds", type=int, default=200)
+    flakiness.add_argument("--scenarios", type=int, default=500)
+    flakiness.set_defaults(func=bench_flakiness)
+    importtime = subparsers.add_parser(
+        "importtime", help="fail when entry point import is slow or loads heavy dependencies"
+    )
+    # scripts measure 25-65ms, any heavy module (requests alone) pushes them well above
+    importtime.add_argument("--budget", type=float, default=100, help="median ms per entry point")
+    importtime.add_argument("--repeat", type=int, default=5)
+    importtime.add_argument("--modules", nargs="+", default=ENTRY_POINTS)
+    importtime.set_defaults(func=bench_importtime)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/python3
+import argparse
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from models import JobSQL
+from myutils import openQAHelper
+from instrumentation import add_profile_arguments, run_profiled
+
+
+class BugrefIndex:
+    """Local SQLite inverted index bugref -> (job, group, build, scenario, comment author).
+
+    Jobs of indexed groups are added once they are finished, comments are fetched only
+    for failed ones. Recent failed jobs without label are rechecked on every update
+    because reviewers label them later. Rows older than not_older_than_weeks are pruned,
+    unfinished jobs included.
+    """
+
+    FINAL_STATES = ("done", "cancelled")
+    JOB_COLUMNS = f"{JobSQL.COLUMNS}, t_created"
+    SCENARIO_COLUMNS = f"group_id, {JobSQL.SCENARIO_COLUMNS}"
+
+    def __init__(self, path: str, logger, not_older_than_weeks: int = 8):
+        self.path = path
+        self.logger = logger
+        self.not_older_than_weeks = not_older_than_weeks
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(
+            """
+            create table if not exists jobs (
+                id integer primary key, test text, result text, flavor text, arch text,
+                build text, group_id integer, version text, machine text, t_created text
+            );
+            create index if not exists jobs_scenario on jobs (group_id, test, arch, flavor, version, machine);
+            create table if not exists bugrefs (
+                bugref text, job_id integer, author text, primary key (bugref, job_id, author)
+            );
+            create index if not exists bugrefs_job on bugrefs (job_id);
+            create index if not exists bugrefs_author on bugrefs (author);
+            create table if not exists pending (id integer primary key, group_id integer, t_created text);
+            create table if not exists index_state (key text primary key, value integer);
+            """
+        )
+        # index written before pending kept group and age, rows get them on next recheck
+        pending_columns = {row[1] for row in self.connection.execute("pragma table_info(pending)")}
+        for column, column_type in (("group_id", "integer"), ("t_created", "text")):
+            if column not in pending_columns:
+                self.connection.execute(f"alter table pending add column {column} {column_type}")
+
+    def horizon(self, weeks: int = None) -> str:
+        return str(datetime.now() - timedelta(weeks=weeks or self.not_older_than_weeks))
+
+    def update(self, helper: openQAHelper, groups: list, refresh_hours: int = 48) -> None:
+        """Index jobs of groups finished since previous update and recheck recent unlabeled ones.
+
+        Failed OSD query or comment fetch rolls the whole update back, next one repeats it.
+        """
+        groups = [int(group) for group in groups]
+        with self._lock:
+            try:
+                finished, to_fetch, labeled = self._update(helper, groups, refresh_hours)
+            except Exception:
+                # last_seen must not move past jobs which did not make it into index
+                self.connection.rollback()
+                raise
+            self.connection.commit()
+        self.logger.info(
+            "Bugref index %s updated: %d jobs finished, comments of %d failed jobs checked, %d labeled",
+            self.path,
+            len(finished),
+            len(to_fetch),
+            labeled,
+        )
+
+    def _update(self, helper: openQAHelper, groups: list[int], refresh_hours: int) -> tuple:
+        """Changes of one update, returns (finished jobs, failed jobs checked, labeled count)"""
+        finished = []
+        for group in groups:
+            last_seen = self._state(f"last_seen:{group}")
+            params = [group, last_seen]
+            query = f"select {self.JOB_COLUMNS} from jobs where group_id=%s and id > %s"
+            if last_seen == 0:
+                query += " and t_created > %s"
+                params.append(self.horizon())
+            finished += self._store_jobs(helper.osd_iter_query(query + " order by id", params=params))
+            # only rows of this group, other groups may be far ahead
+            highest = self.connection.execute(
+                "select max(id) from (select id from jobs where group_id=? "
+                "union all select id from pending where group_id=?)",
+                (group, group),
+            ).fetchone()[0]
+            self._set_state(f"last_seen:{group}", max(highest or 0, last_seen))
+        pending = [row[0] for row in self.connection.execute("select id from pending")]
+        for start in range(0, len(pending), 1000):
+            chunk = pending[start : start + 1000]
+            rows = list(
+                helper.osd_iter_query(
+                    f"select {self.JOB_COLUMNS} from jobs where id in ({', '.join(['%s'] * len(chunk))})",
+                    params=chunk,
+                )
+            )
+            finished += self._store_jobs(rows)
+            # jobs deleted meanwhile would wait forever, failed query raised before this point
+            gone = set(chunk) - {row[0] for row in rows}
+            self.connection.executemany("delete from pending where id=?", ((job_id,) for job_id in gone))
+        # reviewers label failures some time after they finished
+        recent = [
+            row[0]
+            for row in self.connection.execute(
+                f"select id from jobs where result in ({', '.join('?' * len(helper.FAILED_RESULTS))}) "
+                "and t_created > ? and id not in (select job_id from bugrefs)",
+                (*helper.FAILED_RESULTS, str(datetime.now() - timedelta(hours=refresh_hours))),
+            )
+        ]
+        to_fetch = sorted(set(recent) | {job_id for job_id, result in finished if result in helper.FAILED_RESULTS})
+        labeled = 0
+        for job_id, comments in helper.iter_job_comments(to_fetch):
+            rows = {
+                (bugref, job_id, comment.get("userName"))
+                for comment in comments
+                for bugref in comment.get("bugrefs", [])
+            }
+            self.connection.execute("delete from bugrefs where job_id=?", (job_id,))
+            self.connection.executemany("insert into bugrefs values (?, ?, ?)", rows)
+            labeled += bool(rows)
+        self.connection.execute("delete from jobs where t_created < ?", (self.horizon(),))
+        self.connection.execute("delete from pending where t_created < ?", (self.horizon(),))
+        self.connection.execute("delete from bugrefs where job_id not in (select id from jobs)")
+        return finished, to_fetch, labeled
+
+    def _state(self, key: str) -> int:
+        rez = self.connection.execute("select value from index_state where key=?", (key,)).fetchone()
+        return rez[0] if rez else 0
+
+    def _set_state(self, key: str, value: int) -> None:
+        self.connection.execute("insert or replace into index_state values (?, ?)", (key, value))
+
+    def _store_jobs(self, rows) -> list[tuple]:
+        """Store finished jobs, remember unfinished ones, returns (id, result) of finished"""
+        finished = []
+        for job_id, test, result, state, flavor, arch, build, group_id, version, machine, t_created in rows:
+            if state in self.FINAL_STATES:
+                self.connection.execute(
+                    "insert or replace into jobs values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, test, result, flavor, arch, build, group_id, version, machine, str(t_created)),
+                )
+                self.connection.execute("delete from pending where id=?", (job_id,))
+                finished.append((job_id, result))
+            else:
+                self.connection.execute(
+                    "insert or replace into pending values (?, ?, ?)", (job_id, group_id, str(t_created))
+                )
+        return finished
+
+    def _query(self, query: str, params=()) -> list:
+        with self._lock:
+            return self.connection.execute(query, params).fetchall()
+
+    def jobs_with(self, bugref: str, weeks: int = None, user: str = None) -> list:
+        """(job id, group, build, test, arch, flavor, version, machine, author) labeled with bugref"""
+        query = (
+            "select j.id, j.group_id, j.build, j.test, j.arch, j.flavor, j.version, j.machine, b.author "
+            "from bugrefs b join jobs j on j.id = b.job_id where b.bugref = ? and j.t_created > ?"
+        )
+        params = [bugref, self.horizon(weeks)]
+        if user:
+            query += " and b.author = ?"
+            params.append(user)
+        return self._query(query + " order by j.id", params)
+
+    def by_user(self, user: str, weeks: int = None) -> list:
+        """(bugref, number of jobs) labeled by user"""
+        return self._query(
+            "select b.bugref, count(distinct b.job_id) from bugrefs b join jobs j on j.id = b.job_id "
+            "where b.author = ? and j.t_created > ? group by b.bugref order by 2 desc",
+            (user, self.horizon(weeks)),
+        )
+
+    def bugrefs_of(self, job_ids, user: str = None) -> set[str]:
+        bugrefs = set()
+        job_ids = list(job_ids)
+        for start in range(0, len(job_ids), 500):
+            chunk = job_ids[start : start + 500]
+            query = f"select distinct bugref from bugrefs where job_id in ({', '.join('?' * len(chunk))})"
+            params = list(chunk)
+            if user:
+                query += " and author = ?"
+                params.append(user)
+            bugrefs |= {row[0] for row in self._query(query, params)}
+        return bugrefs
+
+    def unlabeled_failed(self, groups: list = None, failed_results=("failed", "timeout_exceeded", "incomplete")) -> list:
+        """Latest jobs of scenarios which failed and carry no bugref"""
+        where = ""
+        params = []
+        if groups:
+            where = f"where group_id in ({', '.join('?' * len(groups))})"
+            params = [int(group) for group in groups]
+        return self._query(
+            f"select id, group_id, build, test, arch, flavor, version, machine, result from ("
+            f"select *, row_number() over (partition by {self.SCENARIO_COLUMNS} order by id desc) as latest "
+            f"from jobs {where}) where latest = 1 and result in ({', '.join('?' * len(failed_results))}) "
+            "and id not in (select job_id from bugrefs) order by group_id, test",
+            (*params, *failed_results),
+        )
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def print_rows(header: list[str], rows: list) -> None:
+    rows = [[str(value) for value in row] for row in rows]
+    widths = [max([len(title)] + [len(row[i]) for row in rows]) for i, title in enumerate(header)]
+    for row in [header] + rows:
+        print(" ".join(f"{value:<{width}}" for value, width in zip(row, widths)).rstrip())
+
+
+def run(args):
+    helper = openQAHelper("bugref_index", None, args.weeks or 8, dryrun=False, debug=False)
+    index = helper.bugref_index()
+    groups = None
+    if args.parent_group:
+        groups = helper.get_child_groups(args.parent_group)
+    elif args.groupid:
+        groups = [int(groupid) for groupid in args.groupid.split(",")]
+    if args.command == "update":
+        if not groups:
+            raise SystemExit("update needs --groupid or --parent-group")
+        index.update(helper, groups, args.refresh_hours)
+    elif args.command == "bug":
+        print_rows(
+            ["job", "group", "build", "test", "arch", "flavor", "version", "machine", "author"],
+            index.jobs_with(args.value, args.weeks, args.user),
+        )
+    elif args.command == "user":
+        print_rows(["bugref", "jobs"], index.by_user(args.value, args.weeks))
+    elif args.command == "unlabeled":
+        print_rows(
+            ["job", "group", "build", "test", "arch", "flavor", "version", "machine", "result"],
+            index.unlabeled_failed(groups, helper.FAILED_RESULTS),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local index of bug references in job comments")
+    parser.add_argument("command", choices=["update", "bug", "user", "unlabeled"])
+    parser.add_argument("value", nargs="?", help="bugref for 'bug', user name for 'user'")
+    parser.add_argument("--groupid", help="comma separated list of job groups")
+    parser.add_argument("--parent-group", help="all job groups of this parent group")
+    parser.add_argument("--weeks", type=int, help="only jobs created in last N weeks")
+    parser.add_argument("--user", help="only comments of this user")
+    parser.add_argument(
+        "--refresh-hours",
+        type=int,
+        default=48,
+        help="recheck comments of unlabeled failed jobs this young",
+    )
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    if args.command in ("bug", "user") and not args.value:
+        parser.error(f"{args.command} needs value")
+    run_profiled(args, run, args)
+
+
+if __name__ == "__main__":
+    main()
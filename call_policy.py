@@ -0,0 +1,219 @@
+import fnmatch
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+
+class TokenBucket:
+    """Allows rate calls per second on average and burst of them at once"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, waiting until it is available. Returns seconds waited"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class AdaptiveLimit:
+    """Concurrency limit with additive increase and multiplicative decrease.
+
+    Every call finished fine raises the limit by 1/limit (so by one per round of calls),
+    call which was rejected, failed on connection or took latency_factor times longer
+    than the fastest recent calls to the same endpoint halves it, at most once per
+    second so one burst of failures does not collapse it to minimum.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1, latency_factor: float = 4.0):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.latency_factor = latency_factor
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._baselines = {}
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, endpoint: str, latency: float, overloaded: bool) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            baseline = self._baselines.get(endpoint, latency)
+            # fastest latency seen, slowly forgotten so baseline follows lasting changes
+            self._baselines[endpoint] = min(latency, baseline + (latency - baseline) * 0.05)
+            now = time.monotonic()
+            if overloaded or latency > max(baseline * self.latency_factor, 0.05):
+                if now - self._last_decrease > 1:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class Attempt:
+    """One try of a call, failed() marks it for retry"""
+
+    def __init__(self, number: int, last: bool):
+        self.number = number
+        self.last = last
+        self.reason = None
+        self.retry_after = None
+
+    def failed(self, reason, retry_after: float = None) -> None:
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CallStatus:
+    """Set overloaded when server pushed back, used by slot() to adapt concurrency"""
+
+    def __init__(self) -> None:
+        self.overloaded = False
+
+
+class CallPolicy:
+    """Rate limit, adaptive concurrency, retries and timeouts shared by calls to one server.
+
+    Typical use:
+
+        for attempt in policy.attempts(f"GET {url}"):
+            with policy.slot(endpoint) as call:
+                ...
+                if transient failure and not attempt.last:
+                    call.overloaded = True
+                    attempt.failed(reason)
+                    continue
+                return result
+    """
+
+    def __init__(
+        self,
+        name: str,
+        logger,
+        rate: float = 0,
+        burst: int = None,
+        concurrency: int = 8,
+        retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        timeout: float = 200,
+        timeouts: list = None,
+        stats=None,
+    ):
+        self.name = name
+        self.logger = logger
+        # rate 0 means no rate limit
+        self.bucket = TokenBucket(rate, burst or concurrency * 2) if rate else None
+        self.limit = AdaptiveLimit(concurrency)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.default_timeout = timeout
+        # (glob pattern of endpoint, seconds), first matching wins
+        self.timeouts = timeouts or []
+        self.stats = stats
+
+    @classmethod
+    def from_config(cls, name: str, logger, config, section: str, stats=None, **defaults):
+        """Policy with defaults overridden by options of config section.
+
+        Options are rate, burst, concurrency, retries, backoff_base, backoff_max, timeout and
+        timeouts as comma separated pattern=seconds list.
+        """
+        options = dict(defaults)
+        for option, convert in (
+            ("rate", float),
+            ("burst", int),
+            ("concurrency", int),
+            ("retries", int),
+            ("backoff_base", float),
+            ("backoff_max", float),
+            ("timeout", float),
+        ):
+            if config.has_option(section, option):
+                options[option] = convert(config.get(section, option))
+        if config.has_option(section, "timeouts"):
+            options["timeouts"] = [
+                (pattern.strip(), float(seconds))
+                for pattern, seconds in (
+                    item.rsplit("=", 1) for item in config.get(section, "timeouts").split(",") if item.strip()
+                )
+            ]
+        return cls(name, logger, stats=stats, **options)
+
+    def endpoint_class(self, endpoint: str) -> str:
+        for pattern, _ in self.timeouts:
+            if fnmatch.fnmatchcase(endpoint, pattern):
+                return pattern
+        return "*"
+
+    def timeout(self, endpoint: str) -> float:
+        for pattern, seconds in self.timeouts:
+            if fnmatch.fnmatchcase(endpoint, pattern):
+                return seconds
+        return self.default_timeout
+
+    def backoff(self, number: int, retry_after: float = None) -> float:
+        """Full jitter exponential backoff, server given Retry-After is the lower bound"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2**number))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def throttle(self) -> None:
+        if self.bucket is not None:
+            waited = self.bucket.acquire()
+            if waited and self.stats is not None:
+                self.stats.record(f"{self.name} throttled", waited)
+
+    @contextmanager
+    def slot(self, endpoint: str, key: str = None):
+        """Wait for rate limit and free concurrency slot, measure the call done inside.
+
+        Latency is compared with earlier calls of same key, by default of endpoint class.
+        """
+        self.throttle()
+        self.limit.acquire()
+        call = CallStatus()
+        started = time.monotonic()
+        try:
+            yield call
+        finally:
+            self.limit.release(key or self.endpoint_class(endpoint), time.monotonic() - started, call.overloaded)
+
+    def attempts(self, what: str):
+        """Yield attempts, sleeping with backoff after every attempt marked as failed"""
+        for number in range(self.retries + 1):
+            attempt = Attempt(number, number == self.retries)
+            yield attempt
+            if attempt.reason is None:
+                return
+            delay = self.backoff(number, attempt.retry_after)
+            self.logger.warning(
+                "%s failed (%s), retry %d/%d in %.1fs", what, attempt.reason, number + 1, self.retries, delay
+            )
+            if self.stats is not None:
+                self.stats.record(f"{self.name} retry", delay)
+            time.sleep(delay)
@@ -2,6 +2,7 @@
 
 import argparse
 from myutils import TaskHelper
+from instrumentation import add_profile_arguments, run_profiled
 
 
 class CleanComments(TaskHelper):
@@ -11,9 +12,9 @@ class CleanComments(TaskHelper):
 
     def run(self, groupid: int):
         comments = self.getJobGroupComments(groupid)
-        for comment in comments:
-            cmd = f"openqa-cli api --host {self.OPENQA_URL_BASE} -X DELETE /groups/{groupid}/comments/{comment}"
-            self.shell_exec(cmd)
+        self.api_write_many(
+            ("DELETE", f"groups/{groupid}/comments/{comment}", None) for comment in comments
+        )
 
 
 def main():
@@ -30,9 +31,10 @@ def main():
         help="Group ID to cleanup",
         required=True,
     )
+    add_profile_arguments(parser)
     args = parser.parse_args()
     force = CleanComments(args.dryrun)
-    force.run(int(args.groupid))
+    run_profiled(args, force.run, int(args.groupid))
 
 
 if __name__ == "__main__":
@@ -1,38 +1,166 @@
 #!/usr/bin/python3
 
+import argparse
+import json
+import os
 import re
-from bs4 import BeautifulSoup
-from urllib.request import urlopen
+import time
 from myutils import TaskHelper
 
+# href attribute values of directory listing, matched on raw bytes while they arrive
+HREF_PATTERN = re.compile(rb"""href=["']([^"']*)["']""", re.IGNORECASE)
+
+
+def iter_hrefs(chunks):
+    """Yield links of HTML page given as byte chunks without building any DOM"""
+    tail = b""
+    for chunk in chunks:
+        data = tail + chunk
+        end = 0
+        for match in HREF_PATTERN.finditer(data):
+            yield match.group(1).decode(errors="replace")
+            end = match.end()
+        # link cut by chunk boundary is completed by next chunk
+        tail = data[max(end, len(data) - 1024) :]
+
 
 class ImageUploader(TaskHelper):
 
-    def __init__(self):
-        super(ImageUploader, self).__init__("ImageUploader", False)
+    IMAGE_PATTERN = re.compile(r"\.\/(SLES15-SP3-Lasso-BYOS.x86_64-[\d\.]+-EC2-HVM-Build[\d\.]+raw.xz)$")
+
+    def __init__(self, dryrun: bool = False):
+        super(ImageUploader, self).__init__("ImageUploader", dryrun)
         self.url = "https://download.suse.de/ibs/Devel:/PubCloud:/Stable:/CrossCloud:/SLE15-SP3:/ModifiedTestImages/images/"
         self.upload_job_id_query = "select max(id) from jobs where group_id='274'  and test='publiccloud_upload_img' and arch='x86_64' and flavor='EC2';"
         self.clone_job_cmd = "/usr/share/openqa/script/clone_job.pl --skip-chained-deps --parental-inheritance --from https://openqa.suse.de --host http://autobot.qa.suse.de  {} WORKER_CLASS=qemu_x86_64 PUBLIC_CLOUD_IMAGE_LOCATION={}"
+        self.state_path = os.path.expanduser(
+            self.config.get(
+                "image_uploader", "state", fallback="~/.cache/openqa-review/image_uploader.json"
+            )
+        )
+
+    def load_state(self) -> dict:
+        try:
+            with open(self.state_path) as state_file:
+                return json.load(state_file)
+        except FileNotFoundError:
+            return None
+
+    def save_state(self, state: dict) -> None:
+        if self.dryrun:
+            return
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as state_file:
+            json.dump(state, state_file)
+        os.replace(tmp_path, self.state_path)
+
+    def iter_images(self, response):
+        for href in iter_hrefs(iter(lambda: response.read(2**16), b"")):
+            m = self.IMAGE_PATTERN.match(href)
+            if m:
+                yield m.group(1)
+
+    def upload(self, images: list[str]) -> list[str]:
+        """Clone upload job for every image, returns images uploaded successfully"""
+        rez = self.osd_query(self.upload_job_id_query)
+        if not rez or rez[0][0] is None:
+            self.logger.error("No publiccloud_upload_img job found to clone")
+            return []
+        cmds = []
+        for image in images:
+            full_url = "{}{}".format(self.url, image)
+            self.logger.info("Will upload {} \n".format(full_url))
+            cmds.append(self.clone_job_cmd.format(rez[0][0], full_url))
+        results = self.shell_exec_many(cmds)
+        return [image for image, result in zip(images, results) if result.returncode == 0]
+
+    def run(self) -> int:
+        """Upload first image found in listing"""
+        from urllib.request import urlopen
+
+        with urlopen(self.url, timeout=60) as response:
+            # listing is read only until first matching link
+            image = next(self.iter_images(response), None)
+        if image is None:
+            self.logger.warning("No image found in %s", self.url)
+            return 1
+        uploaded = self.upload([image])
+        state = self.load_state() or {"uploaded": []}
+        state["uploaded"] = sorted(set(state["uploaded"]) | set(uploaded))
+        self.save_state(state)
+        return 0 if uploaded else 1
+
+    def poll(self) -> int:
+        """Upload images which appeared since previous poll, returns number of uploads.
+
+        Listing is requested with validators of previous response so unchanged listing
+        costs single 304. First poll without state file only records present images.
+        """
+        from urllib.error import HTTPError
+        from urllib.request import Request, urlopen
 
-    def run(self):
-        with urlopen(self.url) as response:
-            soup = BeautifulSoup(response.read(), "html.parser")
-            for a in soup.findAll("a", href=True):
-                m = re.match(
-                    r"\.\/(SLES15-SP3-Lasso-BYOS.x86_64-[\d\.]+-EC2-HVM-Build[\d\.]+raw.xz)$",
-                    a["href"],
-                )
-                if m:
-                    full_url = "{}{}".format(self.url, m.group(1))
-                    self.logger.info("Will upload {} \n".format(full_url))
-                    rez = self.osd_query(self.upload_job_id_query)
-                    self.shell_exec(self.clone_job_cmd.format(rez[0][0], full_url))
-                    return 0
+        state = self.load_state()
+        headers = {}
+        if state is not None:
+            if state.get("etag"):
+                headers["If-None-Match"] = state["etag"]
+            if state.get("last_modified"):
+                headers["If-Modified-Since"] = state["last_modified"]
+        try:
+            with urlopen(Request(self.url, headers=headers), timeout=60) as response:
+                images = list(self.iter_images(response))
+                validators = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
+        except HTTPError as error:
+            if error.code == 304:
+                self.logger.debug("Listing not modified")
+                return 0
+            raise
+        if state is None:
+            self.logger.info("First poll, %d present images are only recorded", len(images))
+            self.save_state({**validators, "uploaded": images})
+            return 0
+        new_images = [image for image in images if image not in state["uploaded"]]
+        uploaded = self.upload(new_images) if new_images else []
+        state["uploaded"] = sorted(set(state["uploaded"]) | set(uploaded))
+        # validators of previous response are kept until every new image is uploaded,
+        # otherwise next poll would get 304 and never retry failed ones
+        if len(uploaded) == len(new_images):
+            state.update(validators)
+        self.save_state(state)
+        self.logger.info("%d new images, %d uploaded", len(new_images), len(uploaded))
+        return len(uploaded)
 
 
 def main():
-    image_uploader = ImageUploader()
-    image_uploader.run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-d",
+        "--dryrun",
+        action="store_true",
+        help="Fake any calls to openQA with log messages",
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="Upload only images not uploaded before, cheap when listing did not change",
+    )
+    parser.add_argument(
+        "--interval", type=int, help="With --poll keep polling every INTERVAL seconds"
+    )
+    args = parser.parse_args()
+    image_uploader = ImageUploader(args.dryrun)
+    if not args.poll:
+        image_uploader.run()
+        return
+    while True:
+        image_uploader.poll()
+        if not args.interval:
+            return
+        time.sleep(args.interval)
 
 
 if __name__ == "__main__":
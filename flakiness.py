@@ -0,0 +1,343 @@
+#!/usr/bin/python3
+import argparse
+import fnmatch
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta
+from myutils import openQAHelper
+from ltp_analysis import Codes, write_report
+from instrumentation import add_profile_arguments, run_profiled
+
+FlakyStats = namedtuple(
+    "FlakyStats",
+    [
+        "scenario",
+        "module",
+        "runs",
+        "failures",
+        "flips",
+        "flip_rate",
+        "longest_streak",
+        "current_streak",
+        "first_failure_build",
+        "last_job",
+    ],
+)
+
+# module results kept in snapshot, one byte per run
+RESULT_CODES = {"passed": b"p", "failed": b"f", "softfailed": b"s"}
+# softfailed module did its job, for flips it counts as pass
+SOFT_AS_PASS = bytes.maketrans(b"s", b"p")
+
+
+def build_snapshot(rows, path: str, meta: dict = None) -> int:
+    """Write snapshot of module results, returns number of runs stored.
+
+    rows are (job id, build, group id, test, arch, flavor, version, machine, module,
+    result) ordered by job id, so every series ends up in chronological order. Without
+    any row ValueError is raised and existing snapshot at path is kept.
+    """
+    scenarios = Codes()
+    modules = Codes()
+    builds = Codes()
+    job_ids = array("q")
+    job_builds = array("I")
+    series = {}
+    last_job = None
+    for job_id, build, group_id, test, arch, flavor, version, machine, module, result in rows:
+        if job_id != last_job:
+            last_job = job_id
+            job_index = len(job_ids)
+            job_ids.append(job_id)
+            job_builds.append(builds.code(build))
+            scenario = scenarios.code((group_id, test, arch, flavor, version, machine))
+        key = (scenario, modules.code(module))
+        runs = series.get(key)
+        if runs is None:
+            runs = series[key] = (array("I"), bytearray())
+        runs[0].append(job_index)
+        runs[1].extend(RESULT_CODES[result])
+    if not series:
+        # empty snapshot would make every failure "new" and hide known flaky ones
+        raise ValueError(f"No module runs to write, {path} left as it was")
+    series_scenario = array("I")
+    series_module = array("I")
+    series_start = array("Q", [0])
+    run_jobs = array("I")
+    run_results = bytearray()
+    for key in sorted(series):
+        jobs, results = series.pop(key)
+        series_scenario.append(key[0])
+        series_module.append(key[1])
+        run_jobs.extend(jobs)
+        run_results += results
+        series_start.append(len(run_results))
+    header = {
+        **(meta or {}),
+        "byteorder": sys.byteorder,
+        "scenarios": scenarios.values,
+        "modules": modules.values,
+        "builds": builds.values,
+    }
+    FlakySnapshot.write(
+        path,
+        header,
+        [
+            ("job_id", job_ids),
+            ("job_build", job_builds),
+            ("series_scenario", series_scenario),
+            ("series_module", series_module),
+            ("series_start", series_start),
+            ("run_job", run_jobs),
+            ("run_result", run_results),
+        ],
+    )
+    return len(run_results)
+
+
+class FlakySnapshot:
+    """Module results of many builds stored column-wise in one memory mapped file.
+
+    Every (scenario, module) pair is one series of runs, results of all series are one
+    byte column so statistics of a series are computed by bytes operations over its
+    slice. File layout is magic, header length, JSON header with string tables and
+    column layout, then columns aligned to 8 bytes in native byte order.
+    """
+
+    MAGIC = b"OQAFLK01"
+    _loaded = {}
+    _loaded_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = None
+        self._columns = {}
+        if self._map[: len(self.MAGIC)] != self.MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not flakiness snapshot")
+        (header_size,) = struct.unpack_from("<Q", self._map, len(self.MAGIC))
+        data_start = self._align(len(self.MAGIC) + 8 + header_size)
+        self.header = json.loads(self._map[len(self.MAGIC) + 8 : len(self.MAGIC) + 8 + header_size])
+        if self.header["byteorder"] != sys.byteorder:
+            self.close()
+            raise ValueError(f"{path} was written with {self.header['byteorder']} endian columns")
+        self.scenarios = [tuple(scenario) for scenario in self.header["scenarios"]]
+        self.modules = self.header["modules"]
+        self.builds = self.header["builds"]
+        self._view = memoryview(self._map)
+        for name, (offset, typecode, length) in self.header["columns"].items():
+            start = data_start + offset
+            self._columns[name] = (start, self._view[start : start + length * array(typecode).itemsize].cast(typecode))
+        self.job_id = self._columns["job_id"][1]
+        self.job_build = self._columns["job_build"][1]
+        self.series_scenario = self._columns["series_scenario"][1]
+        self.series_module = self._columns["series_module"][1]
+        self.series_start = self._columns["series_start"][1]
+        self.run_job = self._columns["run_job"][1]
+        self._results_start = self._columns["run_result"][0]
+        self._series_index = None
+
+    @classmethod
+    def load(cls, path: str) -> "FlakySnapshot":
+        """Snapshot shared by all users of path within the process"""
+        with cls._loaded_lock:
+            if path not in cls._loaded:
+                cls._loaded[path] = cls(path)
+            return cls._loaded[path]
+
+    @staticmethod
+    def _align(offset: int) -> int:
+        return (offset + 7) & ~7
+
+    @classmethod
+    def write(cls, path: str, header: dict, columns: list) -> None:
+        """Write header and (name, array or bytearray) columns, replacing path atomically"""
+        layout = {}
+        offset = 0
+        for name, column in columns:
+            typecode = column.typecode if isinstance(column, array) else "B"
+            layout[name] = [offset, typecode, len(column)]
+            offset = cls._align(offset + len(column) * array(typecode).itemsize)
+        blob = json.dumps({**header, "columns": layout}).encode()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as snapshot:
+                snapshot.write(cls.MAGIC + struct.pack("<Q", len(blob)) + blob)
+                data_start = cls._align(snapshot.tell())
+                for name, column in columns:
+                    snapshot.write(b"\0" * (data_start + layout[name][0] - snapshot.tell()))
+                    snapshot.write(column)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def __len__(self) -> int:
+        return len(self.series_scenario)
+
+    def series(self, scenario: tuple, module: str):
+        """Index of series of module in scenario (group id, test, arch, flavor, version, machine)"""
+        if self._series_index is None:
+            self._series_index = {
+                (self.scenarios[scenario_code], self.modules[module_code]): index
+                for index, (scenario_code, module_code) in enumerate(
+                    zip(self.series_scenario, self.series_module)
+                )
+            }
+        return self._series_index.get((tuple(scenario), module))
+
+    def results(self, index: int) -> bytes:
+        """Results of series runs in chronological order, p(assed), f(ailed) or s(oftfailed)"""
+        start = self._results_start
+        return self._map[start + self.series_start[index] : start + self.series_start[index + 1]]
+
+    def stats(self, index: int) -> FlakyStats:
+        results = self.results(index).translate(SOFT_AS_PASS)
+        runs = len(results)
+        # "pf" and "fp" can not overlap with themselves, so count finds every flip
+        flips = results.count(b"pf") + results.count(b"fp")
+        current_streak = runs - len(results.rstrip(b"f"))
+        end = self.series_start[index + 1]
+        first_failure_build = None
+        if current_streak:
+            first_failure_build = self.builds[self.job_build[self.run_job[end - current_streak]]]
+        return FlakyStats(
+            self.scenarios[self.series_scenario[index]],
+            self.modules[self.series_module[index]],
+            runs,
+            results.count(b"f"),
+            flips,
+            flips / (runs - 1) if runs > 1 else 0.0,
+            max(map(len, results.split(b"p"))),
+            current_streak,
+            first_failure_build,
+            self.job_id[self.run_job[end - 1]],
+        )
+
+    def iter_stats(self):
+        return map(self.stats, range(len(self)))
+
+    def classify(self, scenario: tuple, module: str, flip_rate: float = 0.2, min_runs: int = 5):
+        """Return (verdict, stats) for failure of module in scenario.
+
+        Verdict is "new" when history is shorter than min_runs, "flaky" when result of
+        the module flipped in at least flip_rate of consecutive runs, "regression" otherwise.
+        """
+        index = self.series(scenario, module)
+        if index is None:
+            return "new", None
+        stats = self.stats(index)
+        if stats.runs < min_runs:
+            return "new", stats
+        if stats.flip_rate >= flip_rate:
+            return "flaky", stats
+        return "regression", stats
+
+    def close(self) -> None:
+        # mmap can not be closed while views of it exist
+        for _, column in self._columns.values():
+            column.release()
+        if self._view is not None:
+            self._view.release()
+        self._map.close()
+        self._file.close()
+
+
+def export_snapshot(helper: openQAHelper, groups: list, weeks: int, path: str) -> int:
+    """Bulk export module results of finished jobs of groups in last weeks into snapshot"""
+    groups = [int(group) for group in groups]
+    query = (
+        "select j.id, j.build, j.group_id, j.test, j.arch, j.flavor, j.version, j.machine, m.name, m.result "
+        "from jobs j join job_modules m on m.job_id = j.id "
+        f"where j.group_id in ({', '.join(['%s'] * len(groups))}) and j.state = 'done' and j.t_created > %s "
+        "and m.result in ('passed', 'failed', 'softfailed') order by j.id"
+    )
+    since = str((datetime.now() - timedelta(weeks=weeks)).date())
+    runs = build_snapshot(
+        helper.osd_iter_query(query, params=[*groups, since]),
+        path,
+        {"created": str(datetime.now()), "groups": groups, "since": since},
+    )
+    helper.logger.info("%d module runs of groups %s since %s written to %s", runs, groups, since, path)
+    return runs
+
+
+def snapshot_path(helper: openQAHelper) -> str:
+    return os.path.expanduser(
+        helper.config.get("flakiness", "snapshot", fallback="~/.cache/openqa-review/flakiness.snapshot")
+    )
+
+
+def run(args):
+    helper = openQAHelper("flakiness", None, args.weeks, dryrun=False, debug=False)
+    path = args.snapshot or snapshot_path(helper)
+    if args.command == "export":
+        if args.parent_group:
+            groups = helper.get_child_groups(args.parent_group)
+        elif args.groupid:
+            groups = args.groupid.split(",")
+        else:
+            raise SystemExit("export needs --groupid or --parent-group")
+        export_snapshot(helper, groups, args.weeks, path)
+        return
+    snapshot = FlakySnapshot(path)
+    rows = [
+        stats
+        for stats in snapshot.iter_stats()
+        if stats.runs >= args.min_runs
+        and stats.flips
+        and (not args.test or fnmatch.fnmatchcase(stats.scenario[1], args.test))
+    ]
+    rows.sort(key=lambda stats: (-stats.flip_rate, -stats.runs))
+    write_report(
+        [
+            {
+                "group": stats.scenario[0],
+                "scenario": "/".join(map(str, stats.scenario[1:])),
+                "module": stats.module,
+                "runs": stats.runs,
+                "failures": stats.failures,
+                "flip_rate": round(stats.flip_rate, 3),
+                "longest_streak": stats.longest_streak,
+                "current_streak": stats.current_streak,
+                "failing_since": stats.first_failure_build or "",
+                "last_job": stats.last_job,
+            }
+            for stats in rows[: args.top]
+        ],
+        args.format,
+        sys.stdout,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flakiness of job modules over many builds")
+    parser.add_argument(
+        "command",
+        choices=["export", "top"],
+        help="export: write snapshot from OSD, top: most often flipping modules of snapshot",
+    )
+    parser.add_argument("--snapshot", help="Snapshot file, default from [flakiness] snapshot in config")
+    parser.add_argument("--groupid", help="comma separated list of job groups to export")
+    parser.add_argument("--parent-group", help="export all job groups of this parent group")
+    parser.add_argument("--weeks", type=int, default=26, help="export jobs created in last N weeks")
+    parser.add_argument("--test", help="top: only scenarios with test name matching glob")
+    parser.add_argument("--min-runs", type=int, default=5, help="top: skip series with fewer runs")
+    parser.add_argument("--top", type=int, default=50, help="top: number of rows")
+    parser.add_argument("-f", "--format", choices=["table", "csv", "json"], default="table")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    run_profiled(args, run, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@
 
 import argparse
 from myutils import TaskHelper
+from instrumentation import add_profile_arguments, run_profiled
 
 
 class ForceSoftFailure(TaskHelper):
@@ -10,8 +11,7 @@ class ForceSoftFailure(TaskHelper):
         super().__init__("forceresult", dryrun)
 
     def run(self, jobids: list, bugid: str):
-        for job in jobids:
-            self.add_comment(job, comment=f"label:force_result:softfailed:{bugid}")
+        self.add_comments(jobids, comment=f"label:force_result:softfailed:{bugid}")
 
 
 def main():
@@ -31,9 +31,10 @@ def main():
     parser.add_argument(
         "jobids", help="space separated list of job IDs to process", nargs="+"
     )
+    add_profile_arguments(parser)
     args = parser.parse_args()
     force = ForceSoftFailure(args.dryrun)
-    force.run(args.jobids, args.bugid)
+    run_profiled(args, force.run, args.jobids, args.bugid)
 
 
 if __name__ == "__main__":
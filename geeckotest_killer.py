@@ -1,7 +1,14 @@
 #!/usr/bin/python3
 import argparse
-from myutils import openQAHelper
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from myutils import openQAHelper, JobsList, modules_match
 from models import JobSQL
+from job_filter import JobFilter, FilterError, is_raw_sql
+from instrumentation import add_profile_arguments, run_profiled
+
+ScenarioDiff = namedtuple("ScenarioDiff", ["status", "scenario", "job_a", "job_b", "modules_a", "modules_b"])
 
 
 class Killer(openQAHelper):
@@ -12,102 +19,247 @@ class Killer(openQAHelper):
     # related to older versions. To avoid this we limit query by time
     not_older_than_weeks : int = 7
 
-    def __init__(self, groupid: int, dryrun: bool = False, latest_build: str = None):
+    def __init__(
+        self,
+        groupid: int,
+        dryrun: bool = False,
+        latest_build: str = None,
+        group_overview: dict = None,
+    ):
         super(Killer, self).__init__("killer", groupid, Killer.not_older_than_weeks, dryrun)
+        # use legacy max(id) lookup per job instead of single query to find latest jobs
+        self.per_job_lookup: bool = False
+        # how many clone_job.pl run at once, None means value from config
+        self.parallelism: int = None
+        # --getlabels counts only comments of this user
+        self.label_user: str = None
+        # --getlabels answers from local bugref index instead of comments API
+        self.use_index: bool = False
+        # flakiness.FlakySnapshot telling known flaky module failures from regressions
+        self.flaky = None
+        # one group_overview request gives both latest build and group name
+        if group_overview is None:
+            group_overview = self.get_group_overview(self.groupid)
+        self.group_name = group_overview["group"]["name"]
         if latest_build is None:
-            self.latest_build = self.get_latest_build(self.groupid)
+            self.latest_build = self.get_latest_build(self.groupid, group_overview)
         else:
             self.latest_build = latest_build
         self.logger.info(
-            "%s is latest build for %s", self.latest_build, self.get_group_name()
+            "%s is latest build for %s", self.latest_build, self.group_name
         )
 
     def get_group_name(self) -> str:
-        group_json = self.request_get(
-            f"{self.OPENQA_URL_BASE}group_overview/{self.groupid}.json"
-        )
-        return group_json["group"]["name"]
+        return self.group_name
 
     def get_bugrefs(self, jobs: "list[JobSQL]", filter_by_user=None):
         bugrefs = set()
-        for job in jobs:
-            response = self.request_get(f"{self.OPENQA_API_BASE}jobs/{job.id}/comments")
+        comments = [
+            (job.id, "comments.json", f"{self.OPENQA_API_BASE}jobs/{job.id}/comments")
+            for job in jobs
+        ]
+        for response in self.request_iter_artifacts(comments):
             for comment in response:
                 if not filter_by_user or filter_by_user == comment["userName"]:
                     bugrefs |= set(comment["bugrefs"])
         return bugrefs
 
-    def get_failed_modules(self, job_id):
-        rezult = self.osd_query(
-            f"select name from job_modules where job_id={job_id} and result='failed'"
+    def label_by_module(self, module_filter, comment) -> int:
+        """Comment jobs with failed module matching filter, returns number of comments sent"""
+        jobs_to_review = self.osd_get_jobs_where(self.latest_build, self.per_job_lookup)
+        failed_modules = self.osd_get_failed_modules([job.id for job in jobs_to_review])
+        to_label = []
+        for job in jobs_to_review:
+            matching = [module for module in failed_modules[job.id] if modules_match([module], module_filter)]
+            if not matching:
+                continue
+            # with snapshot loaded jobs failing only in known flaky modules are left out
+            if self.flaky is not None and all(
+                self.failure_verdict(job, module)[0] == "flaky" for module in matching
+            ):
+                self.logger.info("Job %s not labeled, %s known flaky", job.id, ",".join(sorted(matching)))
+                continue
+            to_label.append(job.id)
+        return self.add_comments(to_label, comment)
+
+    def failure_verdict(self, job: JobSQL, module: str):
+        """(verdict, stats) of failed module of job judged by history in flakiness snapshot"""
+        return self.flaky.classify(
+            (job.groupid, *self.scenario_key(job)),
+            module,
+            self.config.getfloat("flakiness", "flip_rate", fallback=0.2),
+            self.config.getint("flakiness", "min_runs", fallback=5),
         )
-        failed_modules = ""
-        rezult.sort()
-        for rez in rezult:
-            if not failed_modules:
-                failed_modules = f"{rez[0]}"
-            else:
-                failed_modules = f"{failed_modules},{rez[0]}"
-        return failed_modules or "NULL"
 
-    def label_by_module(self, module_filter, comment):
-        jobs_to_review = self.osd_get_jobs_where(self.latest_build)
-        for job in jobs_to_review:
-            if module_filter in self.get_failed_modules(job.id):
-                self.add_comment(job.id, comment)
+    def classify_failures(self) -> Counter:
+        """Log failed modules of latest build as flaky, regression or new, returns counts"""
+        jobs = self.osd_get_jobs_where(self.latest_build, self.per_job_lookup)
+        failed = [job for job in jobs if job.result in self.FAILED_RESULTS]
+        failed_modules = self.osd_get_failed_modules([job.id for job in failed])
+        verdicts = Counter()
+        report = {"regression": [], "new": [], "flaky": []}
+        for job in failed:
+            for module in sorted(failed_modules[job.id]):
+                verdict, stats = self.failure_verdict(job, module)
+                verdicts[verdict] += 1
+                line = f"  {self.OPENQA_URL_BASE}t{job.id} {'/'.join(self.scenario_key(job))} {module}"
+                if stats is not None:
+                    line += f" flip rate {stats.flip_rate:.2f} in {stats.runs} runs"
+                    if stats.first_failure_build:
+                        line += f", failing since {stats.first_failure_build}"
+                report[verdict].append(line)
+        lines = [f"Failed modules of build {self.latest_build}:"]
+        for verdict, verdict_lines in report.items():
+            lines.append(f"== {verdict}: {len(verdict_lines)}")
+            lines.extend(verdict_lines)
+        self.logger.info("\n".join(lines))
+        return verdicts
 
     def get_all_labels(self):
-        jobs_to_review = self.osd_get_jobs_where(self.latest_build)
-        # TODO reveal ability to get only comments from certain user
-        # bugrefs = self.get_bugrefs(job.id, filter_by_user='geekotest')
-        bugrefs = self.get_bugrefs(jobs_to_review)
+        jobs_to_review = self.osd_get_jobs_where(self.latest_build, self.per_job_lookup)
+        if self.use_index:
+            bugrefs = self.bugref_index().bugrefs_of([job.id for job in jobs_to_review], self.label_user)
+        else:
+            bugrefs = self.get_bugrefs(jobs_to_review, filter_by_user=self.label_user)
         if len(bugrefs) == 0:
             self.logger.info("No jobs labeled")
         else:
             for bug in bugrefs:
                 self.logger.info(bug)
+        return bugrefs
 
-    def get_jobs_by(self, args):
-        rez = self.osd_get_all_jobs(args.query)
-        ids_list = ""
-        for j1 in rez:
-            if args.delete:
-                cmd = f"openqa-cli api --host {self.OPENQA_URL_BASE} -X DELETE jobs/{j1.id}"
-                self.shell_exec(cmd)
-            elif args.restart:
-                clone_cmd = "/usr/share/openqa/script/clone_job.pl"
-                common_flags = (
-                    " --skip-chained-deps --parental-inheritance "
-                )
-                params_str = ""
-                if args.params:
-                    params_str = " ".join(args.params)
-                cmd = f"{clone_cmd} {common_flags} --within-instance {self.OPENQA_URL_BASE} {j1.id} {params_str}"
-                self.shell_exec(cmd)
-            elif args.comment:
-                self.add_comment(j1.id, args.comment)
-            elif args.delete_comment:
-                self.delete_comment(j1.id)
+    def query_conditions(self, query: str) -> tuple[str, list]:
+        if not query:
+            return "", []
+        if is_raw_sql(query):
+            self.logger.warning(
+                "Raw SQL in --query is deprecated, use filter like 'result=failed test~ltp_* since=7d'"
+            )
+            # fragment ends up in query with bound params, literal % (LIKE patterns) must be escaped
+            return query.replace("%", "%%"), []
+        return JobFilter(query).compile()
+
+    def explain(self, query: str) -> list[str]:
+        plan = self.osd_explain(*self.all_jobs_query(*self.query_conditions(query)))
+        self.logger.info("Query plan:\n%s", "\n".join(plan))
+        return plan
+
+    def get_jobs_by(self, args) -> int:
+        jobs = JobsList(keep_jobs=False)
+        conditions, params = self.query_conditions(args.query)
+        # writes are dispatched while later rows are still fetched
+        found_jobs = self.osd_iter_all_jobs(conditions, jobs, params=params)
+        if args.delete:
+            self.api_write_many(("DELETE", f"jobs/{j1.id}", None) for j1 in found_jobs)
+        elif args.restart:
+            clone_cmd = "/usr/share/openqa/script/clone_job.pl"
+            common_flags = (
+                " --skip-chained-deps --parental-inheritance "
+            )
+            params_str = ""
+            if args.params:
+                params_str = " ".join(args.params)
+            # clones start while later rows are still fetched
+            self.shell_exec_many(
+                (
+                    f"{clone_cmd} {common_flags} --within-instance {self.OPENQA_URL_BASE} {j1.id} {params_str}"
+                    for j1 in found_jobs
+                ),
+                self.parallelism,
+            )
+        elif args.comment:
+            self.add_comments((j1.id for j1 in found_jobs), args.comment)
+        elif args.delete_comment:
+            self.delete_comments([j1.id for j1 in found_jobs])
+        else:
+            ids_list = [str(j1.id) for j1 in found_jobs]
+            if ids_list:
+                self.logger.info(",".join(ids_list))
+        jobs.log(self.logger)
+        return jobs.count
+
+    # unresolved: failed in A, job in B still runs or ended without verdict (cancelled, skipped)
+    DIFF_STATUSES = ("new failure", "fixed", "changed modules", "still failing", "unresolved")
+
+    @staticmethod
+    def scenario_key(job: JobSQL) -> tuple:
+        return job.name, job.arch, job.flavor, job.version, job.machine
+
+    def diff_builds(self, build_a: str, build_b: str) -> list[ScenarioDiff]:
+        """Compare latest job of every scenario in build A with the one in build B.
+
+        Two queries find latest jobs of both builds, one more (per chunk) gets failed
+        modules of all failed ones. Scenario is fixed only when its job in B is done
+        and passed, B still in progress gives unresolved ones. Scenarios passing in both
+        builds and scenarios which failed in A but did not run in B are left out.
+        """
+        jobs_a = {self.scenario_key(job): job for job in self.osd_get_jobs_where(build_a)}
+        jobs_b = {self.scenario_key(job): job for job in self.osd_get_jobs_where(build_b)}
+        failed_ids = [
+            job.id
+            for job in (*jobs_a.values(), *jobs_b.values())
+            if job.result in self.FAILED_RESULTS
+        ]
+        failed_modules = self.osd_get_failed_modules(failed_ids)
+        diff = []
+        for scenario in sorted(jobs_a.keys() | jobs_b.keys()):
+            job_a = jobs_a.get(scenario)
+            job_b = jobs_b.get(scenario)
+            failed_a = job_a is not None and job_a.result in self.FAILED_RESULTS
+            failed_b = job_b is not None and job_b.result in self.FAILED_RESULTS
+            modules_a = failed_modules[job_a.id] if failed_a else set()
+            modules_b = failed_modules[job_b.id] if failed_b else set()
+            if failed_b and not failed_a:
+                status = "new failure"
+            elif failed_a and failed_b:
+                status = "still failing" if modules_a == modules_b else "changed modules"
+            elif failed_a and job_b is not None:
+                passed_b = job_b.state == "done" and job_b.result in self.PASSED_RESULTS
+                status = "fixed" if passed_b else "unresolved"
             else:
-                if len(ids_list) == 0:
-                    ids_list = str(j1.id)
-                else:
-                    ids_list = f"{ids_list},{j1.id}"
-        if ids_list is not None:
-            self.logger.info(ids_list)
+                continue
+            diff.append(ScenarioDiff(status, scenario, job_a, job_b, modules_a, modules_b))
+        self.log_diff(build_a, build_b, diff)
+        return diff
+
+    def log_diff(self, build_a: str, build_b: str, diff: list[ScenarioDiff]) -> None:
+        report = [f"Build {build_a} -> {build_b}:"]
+        for status in self.DIFF_STATUSES:
+            rows = [row for row in diff if row.status == status]
+            report.append(f"== {status}: {len(rows)}")
+            for row in rows:
+                job_a = f"{self.OPENQA_URL_BASE}t{row.job_a.id}" if row.job_a else "-"
+                job_b = f"{self.OPENQA_URL_BASE}t{row.job_b.id}" if row.job_b else "-"
+                modules = ",".join(sorted(row.modules_b or row.modules_a)) or "NULL"
+                if status == "unresolved":
+                    modules = f"{modules}, B is {row.job_b.state}/{row.job_b.result}"
+                if status == "changed modules":
+                    modules = (
+                        f"added {','.join(sorted(row.modules_b - row.modules_a)) or 'none'} "
+                        f"removed {','.join(sorted(row.modules_a - row.modules_b)) or 'none'}"
+                    )
+                report.append(f"  {'/'.join(row.scenario)} {job_a} -> {job_b} {modules}")
+        self.logger.info("\n".join(report))
 
     def delete_comment(self, jobid):
-        response = self.request_get(f"{self.OPENQA_API_BASE}jobs/{jobid}/comments")
-        if response:
-            cmd = f"openqa-cli api --host {self.OPENQA_URL_BASE} -X DELETE /jobs/{jobid}/comments/{response[0]['id']}"
-            self.shell_exec(cmd)
+        self.delete_comments([jobid])
+
+    def delete_comments(self, jobids):
+        """Delete first comment of every job, comments are fetched and deleted concurrently"""
+        urls = [f"{self.OPENQA_API_BASE}jobs/{jobid}/comments" for jobid in jobids]
+        self.api_write_many(
+            ("DELETE", f"jobs/{jobid}/comments/{response[0]['id']}", None)
+            for jobid, response in zip(jobids, self.request_iter_many(urls))
+            if response
+        )
 
     def investigate(self, jobid):
         cmd = f"/usr/share/openqa/script/clone_job.pl --skip-chained-deps --parental-inheritance {jobid} BUILD=INV{jobid} _GROUP=0 --within-instance {self.OPENQA_URL_BASE}"
         variables_set = set()
-        response = self.request_get(
-            f"{self.OPENQA_URL_BASE}tests/{jobid}/file/vars.json"
+        response = self.request_get_artifact(
+            jobid, "vars.json", f"{self.OPENQA_URL_BASE}tests/{jobid}/file/vars.json"
         )
+        clone_cmds = []
         # first collecting ALL _TEST_REPOS variable so later we can reset others when we testing some certain incident
         for var in response:
             if "_TEST_REPOS" in var:
@@ -123,7 +275,8 @@ class Killer(openQAHelper):
                     for empty_var in variables_set:
                         if empty_var != var:
                             test_issues_var = f"{test_issues_var} {empty_var}=''"
-                    self.shell_exec(f"{cmd} {test_issues_var}")
+                    clone_cmds.append(f"{cmd} {test_issues_var}")
+        self.shell_exec_many(clone_cmds, self.parallelism)
 
 
 def main():
@@ -134,12 +287,51 @@ def main():
         action="store_true",
         help="Fake any calls to openQA with log messages",
     )
-    parser.add_argument("-l", "--labelmodule", help="Label failed job")
+    parser.add_argument(
+        "-l",
+        "--labelmodule",
+        help="Label failed jobs where failed module name matches (exact or glob)",
+    )
     parser.add_argument(
         "-g", "--getlabels", action="store_true", help="get list of labels"
     )
-    parser.add_argument("-q", "--query", help="return job ids by filter")
+    parser.add_argument("--user", help="With --getlabels only labels added by this user")
+    parser.add_argument(
+        "--from-index",
+        action="store_true",
+        help="With --getlabels read labels from local bugref index (bugref_index.py update)",
+        default=False,
+    )
+    parser.add_argument(
+        "-q",
+        "--query",
+        help="return job ids by filter e.g. 'result=failed arch=x86_64 test~ltp_* since=7d' "
+        "(fields: id, test, result, state, flavor, arch, build, version, machine, since; "
+        "operators: = != and ~ !~ for text fields, > < >= <= for id; comma separates alternatives)",
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="Show query plan of --query instead of running it",
+        default=False,
+    )
     parser.add_argument("-b", "--build", help="openQA build number")
+    parser.add_argument(
+        "--flaky-snapshot",
+        help="Flakiness snapshot (flakiness.py export), --labelmodule then skips known flaky failures",
+    )
+    parser.add_argument(
+        "--classify",
+        action="store_true",
+        help="Tell flaky failed modules of build from regressions, needs --flaky-snapshot",
+        default=False,
+    )
+    parser.add_argument(
+        "--diff-build",
+        nargs=2,
+        metavar=("A", "B"),
+        help="Compare latest job per scenario of build A with build B",
+    )
     parser.add_argument("-c", "--comment", help="Insert comment to openQA job")
     parser.add_argument(
         "params", help="extra params added to openQA job", nargs="*", default=[]
@@ -152,28 +344,134 @@ def main():
         "--investigate", help="Clone aggregate scenario with indiviual incidents"
     )
     parser.add_argument("--restart", action="store_true", help="restart", default=False)
-    parser.add_argument("--groupid", help="hard code group id", required=True)
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        help="How many clone_job.pl run at once for --restart and --investigate",
+    )
+    groups = parser.add_mutually_exclusive_group(required=True)
+    groups.add_argument(
+        "--groupid", help="hard code group id, comma separated list runs batch over all of them"
+    )
+    groups.add_argument(
+        "--parent-group", help="run batch over all job groups of this parent group"
+    )
+    parser.add_argument(
+        "--group-parallel",
+        type=int,
+        default=4,
+        help="How many groups are processed at once in batch mode",
+    )
     parser.add_argument(
         "--showsql", action="store_true", help="Show sql", default=False
     )
+    parser.add_argument(
+        "--per-job-lookup",
+        action="store_true",
+        help="Find latest jobs with separate query per job (legacy, slow)",
+        default=False,
+    )
+    parser.add_argument(
+        "--mirror",
+        action="store_true",
+        help="Sync local mirror of OSD and run all queries against it",
+        default=False,
+    )
     parser.add_argument(
         "--all",
         action="store_true",
         help="No extra conditions everything is selected",
         default=False,
     )
+    add_profile_arguments(parser)
     args = parser.parse_args()
-    killer = Killer(args.groupid, args.dryrun, args.build)
+    if args.query and not is_raw_sql(args.query):
+        try:
+            JobFilter(args.query)
+        except FilterError as error:
+            parser.error(str(error))
+    if args.classify and not args.flaky_snapshot:
+        parser.error("--classify needs --flaky-snapshot")
+    run_profiled(args, run, args)
+
+
+def run(args):
+    if args.parent_group:
+        helper = openQAHelper("killer", None, Killer.not_older_than_weeks, args.dryrun)
+        run_batch(args, helper.get_child_groups(args.parent_group))
+    elif "," in args.groupid:
+        run_batch(args, [groupid.strip() for groupid in args.groupid.split(",")])
+    else:
+        killer = Killer(args.groupid, args.dryrun, args.build)
+        dispatch(killer, args)
+
+
+def dispatch(killer: Killer, args) -> str:
+    """Apply command line options to killer and run selected action, returns its outcome"""
     if args.showsql:
         killer.showsql = True
+    killer.per_job_lookup = args.per_job_lookup
+    killer.parallelism = args.parallel
+    killer.label_user = args.user
+    killer.use_index = args.from_index
+    if args.flaky_snapshot:
+        from flakiness import FlakySnapshot
+
+        killer.flaky = FlakySnapshot.load(args.flaky_snapshot)
+    if args.mirror and killer.mirror is None:
+        killer.use_mirror()
     if args.getlabels:
-        killer.get_all_labels()
+        return f"{len(killer.get_all_labels())} bugrefs"
     elif args.labelmodule:
-        killer.label_by_module(args.labelmodule, args.comment)
+        return f"{killer.label_by_module(args.labelmodule, args.comment)} jobs labeled"
+    elif args.diff_build:
+        diff = killer.diff_builds(*args.diff_build)
+        return ", ".join(
+            f"{sum(row.status == status for row in diff)} {status}" for status in killer.DIFF_STATUSES
+        )
+    elif args.explain:
+        return f"{len(killer.explain(args.query))} plan lines"
+    elif args.classify:
+        verdicts = killer.classify_failures()
+        return ", ".join(f"{verdicts[verdict]} {verdict}" for verdict in ("regression", "new", "flaky"))
     elif args.query or args.all:
-        killer.get_jobs_by(args)
+        return f"{killer.get_jobs_by(args)} jobs"
     elif args.investigate:
         killer.investigate(args.investigate)
+        return "investigated"
+    return "nothing to do"
+
+
+def run_batch(args, groupids: list) -> None:
+    """Process many groups concurrently sharing OSD connections and HTTP session"""
+    helper = openQAHelper("killer", None, Killer.not_older_than_weeks, args.dryrun)
+    overviews = helper.request_get_many(
+        [f"{helper.OPENQA_URL_BASE}group_overview/{groupid}.json" for groupid in groupids],
+        missing_ok=True,
+    )
+    if args.mirror:
+        # synced once here, every Killer picks up the same mirror
+        helper.use_mirror()
+
+    def process(groupid, overview):
+        started = time.monotonic()
+        if overview is None:
+            return groupid, "", "", "group not found", 0.0
+        build = args.build or helper.get_latest_build(groupid, overview)
+        try:
+            killer = Killer(groupid, args.dryrun, build, overview)
+            outcome = dispatch(killer, args)
+        except Exception as error:
+            helper.logger.exception("Group %s failed", groupid)
+            outcome = f"FAILED: {error}"
+        return groupid, overview["group"]["name"], build, outcome, time.monotonic() - started
+
+    with ThreadPoolExecutor(max_workers=args.group_parallel, thread_name_prefix="group") as executor:
+        results = list(executor.map(process, groupids, overviews))
+    report = [f"{'group':>6}  {'name':<50} {'build':<20} {'time':>8}  outcome"]
+    for groupid, name, build, outcome, seconds in results:
+        report.append(f"{groupid:>6}  {name:<50} {str(build):<20} {seconds:7.1f}s  {outcome}")
+    helper.logger.info("Batch report:\n%s", "\n".join(report))
 
 
 if __name__ == "__main__":
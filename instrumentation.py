@@ -0,0 +1,106 @@
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class CallStats:
+    """Thread safe recorder of call latencies grouped by operation name"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._samples = defaultdict(list)
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self._samples[name].append(seconds)
+
+    @contextmanager
+    def measure(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def summary(self) -> list[dict]:
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+        rows = []
+        for name, values in sorted(samples.items()):
+            rows.append(
+                {
+                    "name": name,
+                    "count": len(values),
+                    "total": sum(values),
+                    "p50": _percentile(values, 50),
+                    "p90": _percentile(values, 90),
+                    "p99": _percentile(values, 99),
+                    "max": values[-1],
+                }
+            )
+        return rows
+
+    def format_table(self) -> str:
+        lines = [
+            f"{'operation':<20} {'count':>7} {'total s':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+        ]
+        for row in self.summary():
+            lines.append(
+                f"{row['name']:<20} {row['count']:>7} {row['total']:>9.3f} {row['p50'] * 1000:>9.1f} "
+                f"{row['p90'] * 1000:>9.1f} {row['p99'] * 1000:>9.1f} {row['max'] * 1000:>9.1f}"
+            )
+        return "\n".join(lines)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+
+def _percentile(values: list, percent: int) -> float:
+    # nearest-rank on already sorted values
+    index = max(0, -(-len(values) * percent // 100) - 1)
+    return values[index]
+
+
+# shared by all helpers in the process
+call_stats = CallStats()
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print time spent in SQL, HTTP and subprocess calls at exit",
+        default=False,
+    )
+    parser.add_argument("--profile-json", help="Write call statistics as JSON to this file")
+    parser.add_argument("--profile-dump", help="Run under cProfile and dump stats to this file")
+
+
+def run_profiled(args: argparse.Namespace, func, *func_args):
+    """Call func(*func_args) honouring profile arguments added by add_profile_arguments"""
+    import cProfile
+
+    profiler = cProfile.Profile() if args.profile_dump else None
+    started = time.perf_counter()
+    try:
+        if profiler is not None:
+            return profiler.runcall(func, *func_args)
+        return func(*func_args)
+    finally:
+        if profiler is not None:
+            profiler.dump_stats(args.profile_dump)
+        if args.profile:
+            print(call_stats.format_table(), file=sys.stderr)
+            print(f"wall time {time.perf_counter() - started:.3f}s", file=sys.stderr)
+        if args.profile_json:
+            with open(args.profile_json, "w") as json_file:
+                json.dump(
+                    {"wall_time": time.perf_counter() - started, "calls": call_stats.summary()},
+                    json_file,
+                    indent=2,
+                )
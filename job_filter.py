@@ -0,0 +1,105 @@
+import re
+import shlex
+from datetime import datetime, timedelta
+
+
+class FilterError(ValueError):
+    pass
+
+
+class JobFilter:
+    """Small filter language for jobs compiled to parameterized SQL.
+
+    Filter is whitespace separated list of conditions, all of them must match:
+
+        result=failed,incomplete   one of listed values
+        arch!=aarch64              anything but value
+        test~ltp_*                 glob match (* and ?), not for id
+        test!~*_img                glob does not match
+        id>14000000                comparison of single id, also <, >=, <=
+        since=7d                   created within last 7 days (h, d, w units)
+
+    Values are never put into SQL text, compile() returns placeholders and values.
+    """
+
+    FIELDS = {
+        "id": "id",
+        "test": "test",
+        "name": "test",
+        "result": "result",
+        "state": "state",
+        "flavor": "flavor",
+        "arch": "arch",
+        "build": "build",
+        "version": "version",
+        "machine": "machine",
+    }
+    UNITS = {"h": "hours", "d": "days", "w": "weeks"}
+    CONDITION = re.compile(r"^(?P<field>[a-z_]+)(?P<op>!=|!~|>=|<=|=|~|>|<)(?P<value>.+)$")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.conditions = [self._parse(token) for token in shlex.split(text)]
+
+    def _parse(self, token: str) -> tuple:
+        match = self.CONDITION.match(token)
+        if not match:
+            raise FilterError(f"Cannot parse condition '{token}'")
+        field, op, value = match.group("field", "op", "value")
+        if field == "since":
+            if op != "=":
+                raise FilterError("since supports only '='")
+            return "since", op, self._since(value)
+        if field not in self.FIELDS:
+            raise FilterError(f"Unknown field '{field}', known are: since, {', '.join(self.FIELDS)}")
+        if op in (">", "<", ">=", "<=") and field != "id":
+            raise FilterError(f"'{op}' is supported only for id")
+        if field == "id":
+            if op in ("~", "!~"):
+                raise FilterError(f"'{op}' is not supported for id, use '=' with comma separated ids")
+            try:
+                value = [int(one_value) for one_value in value.split(",")]
+            except ValueError:
+                raise FilterError(f"id must be number, got '{value}'")
+            if len(value) > 1 and op not in ("=", "!="):
+                raise FilterError(f"'{op}' takes single id")
+        elif op in ("=", "!="):
+            value = value.split(",")
+        return self.FIELDS[field], op, value
+
+    def _since(self, value: str) -> str:
+        match = re.fullmatch(r"(\d+)([hdw])", value)
+        if not match:
+            raise FilterError(f"since expects value like 12h, 7d or 2w, got '{value}'")
+        delta = timedelta(**{self.UNITS[match.group(2)]: int(match.group(1))})
+        return str(datetime.now() - delta)
+
+    @staticmethod
+    def _like(glob: str) -> str:
+        escaped = glob.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return escaped.replace("*", "%").replace("?", "_")
+
+    def compile(self) -> tuple[str, list]:
+        """Return (" and ..." SQL fragment with %s placeholders, list of bound values)"""
+        sql = []
+        params = []
+        for column, op, value in self.conditions:
+            if column == "since":
+                sql.append("t_created > %s")
+                params.append(value)
+            elif op in ("~", "!~"):
+                sql.append(f"{column} {'not ' if op == '!~' else ''}like %s escape '\\'")
+                params.append(self._like(value))
+            elif op in ("=", "!=") and len(value) > 1:
+                placeholders = ", ".join(["%s"] * len(value))
+                sql.append(f"{column} {'not ' if op == '!=' else ''}in ({placeholders})")
+                params.extend(value)
+            else:
+                sql.append(f"{column} {op} %s")
+                params.append(value[0] if isinstance(value, list) else value)
+        return "".join(f" and {condition}" for condition in sql), params
+
+
+def is_raw_sql(text: str) -> bool:
+    """Legacy --query values are SQL fragments starting with and/or"""
+    return text.strip().lower().startswith(("and ", "or "))
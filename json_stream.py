@@ -0,0 +1,96 @@
+import codecs
+import json
+
+
+class _Buffer:
+    """Text decoded from byte chunks, refilled on demand and compacted as it is consumed"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """Append next chunk, False when input is exhausted"""
+        if self.eof:
+            return False
+        if self.pos > len(self.text) // 2:
+            self.text = self.text[self.pos :]
+            self.pos = 0
+        for chunk in self.chunks:
+            text = self.decoder.decode(chunk)
+            if text:
+                self.text += text
+                return True
+        self.text += self.decoder.decode(b"", final=True)
+        self.eof = True
+        return False
+
+    def peek(self) -> str:
+        """Next non whitespace character without consuming it, empty string at end"""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at {self.pos}, got '{self.peek()}'")
+        self.pos += 1
+
+    def value(self, decoder: json.JSONDecoder):
+        """Decode next complete JSON value, reading more input while it is cut off"""
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # number at the end of buffer may continue in next chunk
+            if end == len(self.text) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_array_items(chunks, key: str):
+    """Yield items of array stored under key of top level JSON object.
+
+    chunks is iterable of bytes (HTTP response body, file). Only one item and one
+    chunk are held in memory at a time, other top level values are decoded and dropped.
+    """
+    decoder = json.JSONDecoder()
+    buffer = _Buffer(chunks)
+    buffer.expect("{")
+    if buffer.peek() == "}":
+        return
+    while True:
+        name = buffer.value(decoder)
+        buffer.expect(":")
+        if name == key and buffer.peek() == "[":
+            buffer.expect("[")
+            if buffer.peek() == "]":
+                buffer.pos += 1
+            else:
+                while True:
+                    yield buffer.value(decoder)
+                    if buffer.peek() == "]":
+                        buffer.pos += 1
+                        break
+                    buffer.expect(",")
+        else:
+            buffer.value(decoder)
+        if buffer.peek() == "}":
+            return
+        buffer.expect(",")
+
+
+def iter_file_chunks(file_obj, chunk_size: int = 2**16):
+    return iter(lambda: file_obj.read(chunk_size), b"")
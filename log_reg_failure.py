@@ -1,29 +1,138 @@
 #!/usr/bin/python3.11
 
 import argparse
-import urllib3
+import csv
+import json
+import sys
 from myutils import TaskHelper
+from instrumentation import add_profile_arguments, run_profiled
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 class LogRegFailure(TaskHelper):
 
-    def __init__(self):
+    FIELDS = ["id", "started", "version", "flavor", "arch", "region", "url"]
+    # fixed widths let table rows be printed as soon as they arrive
+    TABLE_WIDTHS = {"id": 9, "started": 20, "version": 10, "flavor": 24, "arch": 8, "region": 16, "url": 0}
+    # start time buckets are prefixes of ISO t_started, 2024-01-31 and 2024-01-31T12
+    STARTED_BUCKETS = {"day": 10, "hour": 13}
+    GROUPS = ["region", "version", "flavor", "arch", *STARTED_BUCKETS]
+
+    def __init__(self, chunk_size: int = 100):
         super(LogRegFailure, self).__init__("LogRegFailure", dryrun=False, debug=False)
+        self.chunk_size = chunk_size
+
+    def fetch_jobs(self, ids: list[str]):
+        """Yield job dicts using multi-ID job listing, one request per chunk of ids.
+
+        Falls back to concurrent single job requests when listing is not available.
+        """
+        chunks = [ids[i : i + self.chunk_size] for i in range(0, len(ids), self.chunk_size)]
+        urls = [f"{TaskHelper.OPENQA_URL_BASE}api/v1/jobs?ids={','.join(chunk)}" for chunk in chunks]
+        done = set()
+        try:
+            for response in self.request_iter_many(urls):
+                for job in response["jobs"]:
+                    done.add(str(job["id"]))
+                    yield job
+            return
+        except Exception as error:
+            self.logger.warning("Multi-ID job listing failed (%s), fetching jobs one by one", error)
+        remaining = [one_id for one_id in ids if one_id not in done]
+        for resp in self.request_iter_many(
+            f"{TaskHelper.OPENQA_URL_BASE}api/v1/jobs/{one_id}" for one_id in remaining
+        ):
+            yield resp["job"]
+
+    @staticmethod
+    def job_row(job: dict) -> dict:
+        settings = job.get("settings", {})
+        return {
+            "id": job["id"],
+            "started": job.get("t_started") or "",
+            "version": settings.get("VERSION", ""),
+            "flavor": settings.get("FLAVOR", ""),
+            "arch": settings.get("ARCH", ""),
+            "region": settings.get("PUBLIC_CLOUD_REGION", ""),
+            "url": f"{TaskHelper.OPENQA_URL_BASE}t{job['id']}",
+        }
+
+    def group_key(self, group_by: str):
+        """Function returning group value of row"""
+        if group_by in self.STARTED_BUCKETS:
+            length = self.STARTED_BUCKETS[group_by]
+            return lambda row: row["started"][:length]
+        return lambda row: row[group_by]
+
+    def run(self, jobid: str, output_format: str = "table", sort_by: str = None, group_by: str = None):
+        ids = [one_id.strip() for one_id in jobid.split(",") if one_id.strip()]
+        rows = (self.job_row(job) for job in self.fetch_jobs(ids))
+        group_of = self.group_key(group_by) if group_by else None
+        if sort_by or group_by:
+            # needs all rows, sorted once by group and then by sort field
+            rows = sorted(
+                rows,
+                key=lambda row: (group_of(row) if group_by else "", row[sort_by] if sort_by else ""),
+            )
+        writer = RowWriter(output_format, self.FIELDS, self.TABLE_WIDTHS, sys.stdout)
+        current_group = None
+        for row in rows:
+            if group_by and group_of(row) != current_group:
+                current_group = group_of(row)
+                writer.group(group_by, current_group)
+            writer.write(row)
+
+
+class RowWriter:
+    """Write rows one by one as aligned table, CSV or JSON lines"""
+
+    def __init__(self, output_format: str, fields: list[str], widths: dict, stream):
+        self.output_format = output_format
+        self.fields = fields
+        self.widths = widths
+        self.stream = stream
+        if output_format == "csv":
+            self.csv = csv.DictWriter(stream, fieldnames=fields)
+            self.csv.writeheader()
+        elif output_format == "table":
+            self._table_line({field: field.upper() for field in fields})
+
+    def _table_line(self, row: dict) -> None:
+        print(
+            " ".join(f"{str(row[field]):<{self.widths[field]}}" for field in self.fields).rstrip(),
+            file=self.stream,
+            flush=True,
+        )
+
+    def group(self, field: str, value) -> None:
+        # csv and jsonl carry group value in every row already
+        if self.output_format == "table":
+            print(f"\n== {field}: {value}", file=self.stream)
 
-    def run(self, jobid: str):
-        ids = jobid.split(",")
-        for one_id in ids:
-            resp = self.request_get(f'{TaskHelper.OPENQA_URL_BASE}api/v1/jobs/{one_id}')
-            self.logger.info(f'{resp["job"]["t_started"]} {resp["job"]["settings"]["VERSION"]} {resp["job"]["settings"]["FLAVOR"]} {resp["job"]["settings"]["ARCH"]} {resp["job"]["settings"]["PUBLIC_CLOUD_REGION"]} {TaskHelper.OPENQA_URL_BASE}t{one_id}')
+    def write(self, row: dict) -> None:
+        if self.output_format == "csv":
+            self.csv.writerow(row)
+            self.stream.flush()
+        elif self.output_format == "jsonl":
+            print(json.dumps(row), file=self.stream, flush=True)
+        else:
+            self._table_line(row)
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("-j", "--jobid", required=True)
+    parser.add_argument("-j", "--jobid", required=True, help="comma separated list of job IDs")
+    parser.add_argument("-f", "--format", choices=["table", "csv", "jsonl"], default="table")
+    parser.add_argument("--sort-by", choices=LogRegFailure.FIELDS, help="sort rows, waits for all jobs")
+    parser.add_argument(
+        "--group-by",
+        choices=LogRegFailure.GROUPS,
+        help="group rows, day and hour bucket start time, waits for all jobs",
+    )
+    parser.add_argument("--chunk", type=int, default=100, help="job IDs per multi-ID request")
+    add_profile_arguments(parser)
     args = parser.parse_args()
 
-    LogRegFailure().run(args.jobid)
+    run_profiled(args, LogRegFailure(args.chunk).run, args.jobid, args.format, args.sort_by, args.group_by)
 
 
 if __name__ == "__main__":
@@ -1,29 +1,207 @@
 #!/usr/bin/python3
+import argparse
+import csv
+import json
+import sys
+from array import array
+from collections import Counter
+from itertools import chain, compress, repeat
 from myutils import openQAHelper
+from instrumentation import add_profile_arguments, run_profiled
 from models import JobSQL
-from collections import defaultdict
-import requests
+from job_filter import JobFilter, FilterError
 
 
-class FailedModule:
+class _CodeIndex(dict):
+    """Code of every value, unknown value gets next code on lookup"""
+
+    def __init__(self, values: list) -> None:
+        super().__init__()
+        self.values = values
+
+    def __missing__(self, value) -> int:
+        code = self[value] = len(self.values)
+        self.values.append(value)
+        return code
+
+
+class Codes:
+    """Maps repeated strings to small integer codes and back"""
+
+    def __init__(self) -> None:
+        self.values = []
+        self._index = _CodeIndex(self.values)
+        # plain dict lookup, so map(codes.code, values) stays in C for known values
+        self.code = self._index.__getitem__
+
+    def get(self, value: str) -> int:
+        """Code of value or None when it was never coded"""
+        return self._index.get(value)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class FailureMatrix:
+    """Failed LTP test cases of analyzed jobs stored column-wise.
+
+    Every analyzed job is one row of job columns (id and code of its (arch, flavor,
+    version, machine) combination), every failed test case is one row of failure
+    columns (job row and coded test case). Jobs share only few combinations, so
+    failures are counted per (combination, test case) while adding jobs and every
+    report folds these few thousand counts instead of walking all failures.
+    """
+
+    JOB_ATTRIBUTES = ("arch", "flavor", "version", "machine")
+    SPREAD_COLUMNS = {"arch": "arches", "flavor": "flavors", "version": "versions", "machine": "machines"}
+
     def __init__(self) -> None:
-        self.modules = defaultdict(
-            lambda: {
-                "arches": set(),
-                "flavors": set(),
-                "job_ids": set(),
-                "machines": set(),
-                "versions": set(),
+        self.modules = Codes()
+        self.codes = {attribute: Codes() for attribute in self.JOB_ATTRIBUTES}
+        self.job_ids = array("q")
+        # (arch, flavor, version, machine) values and value codes of every combination
+        self.combinations = Codes()
+        self.combination_codes = []
+        # failures of every test case per combination code
+        self.combination_modules = []
+        self.job_combinations = array("I")
+        self.job_failures = array("I")
+        self.failure_jobs = array("I")
+        self.failure_modules = array("I")
+        self._pairs = {}
+
+    def add_job(self, job: JobSQL, failed_modules) -> None:
+        row = len(self.job_ids)
+        self.job_ids.append(job.id)
+        values = (job.arch, job.flavor, job.version, job.machine)
+        combination = self.combinations.get(values)
+        if combination is None:
+            combination = self.combinations.code(values)
+            self.combination_codes.append(
+                tuple(self.codes[attribute].code(value) for attribute, value in zip(self.JOB_ATTRIBUTES, values))
+            )
+            self.combination_modules.append(Counter())
+        self.job_combinations.append(combination)
+        # test case reported twice in one job is still one failing job
+        module_codes = dict.fromkeys(map(self.modules.code, failed_modules))
+        failures = len(module_codes)
+        self.job_failures.append(failures)
+        if failures:
+            self.combination_modules[combination].update(module_codes.keys())
+            self.failure_jobs.extend(repeat(row, failures))
+            self.failure_modules.extend(module_codes)
+            self._pairs = {}
+
+    def _projection(self, attribute: str) -> list[int]:
+        """Attribute value code of every combination code"""
+        index = self.JOB_ATTRIBUTES.index(attribute)
+        return [codes[index] for codes in self.combination_codes]
+
+    def _pair_counts(self, attribute: str) -> dict:
+        """Counter of test case codes per attribute value code"""
+        if attribute not in self._pairs:
+            pairs = {}
+            for value_code, modules in zip(self._projection(attribute), self.combination_modules):
+                if value_code in pairs:
+                    pairs[value_code].update(modules)
+                else:
+                    pairs[value_code] = modules.copy()
+            self._pairs[attribute] = pairs
+        return self._pairs[attribute]
+
+    def _totals(self) -> Counter:
+        """Number of failures of every test case code"""
+        return sum(self._pair_counts("arch").values(), Counter())
+
+    def module_by(self, attribute: str = "arch") -> list[dict]:
+        """Cross-tab of failure counts, one row per test case and column per attribute value"""
+        values = self.codes[attribute].values
+        totals = self._totals()
+        rows = [
+            {"module": name, **dict.fromkeys(values, 0), "total": totals[code]}
+            for code, name in enumerate(self.modules.values)
+        ]
+        for value_code, modules in self._pair_counts(attribute).items():
+            value = values[value_code]
+            for module_code, count in modules.items():
+                rows[module_code][value] = count
+        rows.sort(key=lambda row: (-row["total"], row["module"]))
+        return rows
+
+    def rate_by(self, attribute: str = "flavor") -> list[dict]:
+        """Share of analyzed jobs with at least one failed test case per attribute value"""
+        projection = self._projection(attribute)
+        jobs = Counter()
+        failing_jobs = Counter()
+        failures = Counter()
+        combination_failing_jobs = Counter(compress(self.job_combinations, self.job_failures))
+        for combination, count in Counter(self.job_combinations).items():
+            code = projection[combination]
+            jobs[code] += count
+            failing_jobs[code] += combination_failing_jobs[combination]
+            failures[code] += self.combination_modules[combination].total()
+        rows = [
+            {
+                attribute: value,
+                "jobs": jobs[code],
+                "failing_jobs": failing_jobs[code],
+                "failures": failures[code],
+                "rate": round(failing_jobs[code] / jobs[code], 3),
+            }
+            for code, value in enumerate(self.codes[attribute].values)
+        ]
+        rows.sort(key=lambda row: (-row["rate"], row[attribute]))
+        return rows
+
+    def top(self, limit: int = 20) -> list[dict]:
+        """Test cases failing in most jobs with number of distinct attribute values they hit"""
+        jobs = self._totals()
+        # every attribute value a test case failed with is one key of its Counter
+        spread = {
+            attribute: Counter(chain.from_iterable(self._pair_counts(attribute).values()))
+            for attribute in self.JOB_ATTRIBUTES
+        }
+        rows = []
+        for module_code, count in jobs.most_common(limit):
+            row = {"module": self.modules.values[module_code], "jobs": count}
+            for attribute, column in self.SPREAD_COLUMNS.items():
+                row[column] = spread[attribute][module_code]
+            rows.append(row)
+        return rows
+
+    def jobs_of(self, module: str) -> list[int]:
+        module_code = self.modules.get(module)
+        return sorted(
+            {
+                self.job_ids[row]
+                for row, code in zip(self.failure_jobs, self.failure_modules)
+                if code == module_code
             }
         )
 
-    def append(self, name: str, job: JobSQL):
-        m = self.modules[name]
-        m["arches"].add(job.arch)
-        m["flavors"].add(job.flavor)
-        m["job_ids"].add(job.id)
-        m["machines"].add(job.machine)
-        m["versions"].add(job.version)
+
+def write_report(rows: list[dict], output_format: str, stream) -> None:
+    """Write report rows as aligned table, CSV or JSON"""
+    if output_format == "json":
+        json.dump(rows, stream, indent=2)
+        stream.write("\n")
+        return
+    if not rows:
+        return
+    fields = list(rows[0])
+    if output_format == "csv":
+        writer = csv.DictWriter(stream, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+        return
+    widths = {field: max(len(field), *(len(str(row[field])) for row in rows)) for field in fields}
+    stream.write(" ".join(f"{field:<{widths[field]}}" for field in fields).rstrip() + "\n")
+    for row in rows:
+        stream.write(" ".join(f"{str(row[field]):<{widths[field]}}" for field in fields).rstrip() + "\n")
+
+
+def failed_test_fqn(result: dict):
+    return result["test_fqn"] if result.get("status") == "fail" else None
 
 
 class LTPAnalyze(openQAHelper):
@@ -32,29 +210,73 @@ class LTPAnalyze(openQAHelper):
         # currently LTP mainly executed only in Incidents job group this is why we can hardcode it
         super(LTPAnalyze, self).__init__("killer", 430, 2, False, False)
 
-    def analyze(self):
-        ranged_by_module = FailedModule()
-        for j1 in self.osd_get_all_jobs(
-            " and test='publiccloud_ltp' and result='failed' ", False
+    def analyze(self, since: str = None) -> FailureMatrix:
+        matrix = FailureMatrix()
+        query = "test=publiccloud_ltp result=failed"
+        if since:
+            query += f" since={since}"
+        conditions, params = JobFilter(query).compile()
+        jobs = self.osd_get_all_jobs(conditions, False, params)
+        results = [
+            (j1.id, "results.json", f"{self.OPENQA_URL_BASE}tests/{j1.id}/file/results.json")
+            for j1 in jobs
+        ]
+        # jobs are finished so results never change and are read from cache after first run,
+        # jobs which did not upload results.json are answered with 404 and skipped.
+        # results.json has thousands of cases, they are parsed while the body arrives
+        # and only names of failed ones are kept
+        for j1, failed_modules in zip(
+            jobs,
+            self.request_iter_artifact_items(
+                results, "results", failed_test_fqn, immutable=True, missing_ok=True
+            ),
         ):
-            results_url = f"{self.OPENQA_URL_BASE}tests/{j1.id}/file/results.json"
-            code = requests.head(results_url)
-            if code.status_code == 200:
-                result = self.request_get(results_url)
-                failed_modules = []
-                for mod1 in result["results"]:
-                    if mod1["status"] == "fail":
-                        failed_modules.append(mod1["test_fqn"])
-                        ranged_by_module.append(mod1["test_fqn"], j1)
+            if failed_modules is not None:
+                matrix.add_job(j1, failed_modules)
                 self.logger.info(j1.investigate_str(failed_modules))
-        self.logger.info("Now ranged by LTP test view")
-        for mod1 in ranged_by_module.modules.keys():
-            self.logger.info(f"Module: {mod1} : {ranged_by_module.modules[mod1]}")
+        self.logger.info(
+            "%d jobs analyzed, %d failed test cases, %d distinct",
+            len(matrix.job_ids),
+            len(matrix.failure_modules),
+            len(matrix.modules),
+        )
+        return matrix
 
 
-def main():
+REPORTS = {
+    "top": lambda matrix, args: matrix.top(args.top),
+    "module-arch": lambda matrix, args: matrix.module_by("arch"),
+    "module-version": lambda matrix, args: matrix.module_by("version"),
+    "flavor-rate": lambda matrix, args: matrix.rate_by("flavor"),
+    "arch-rate": lambda matrix, args: matrix.rate_by("arch"),
+}
+
 
-    LTPAnalyze().analyze()
+def run(args):
+    matrix = LTPAnalyze().analyze(args.since)
+    rows = REPORTS[args.report](matrix, args)
+    if args.output:
+        with open(args.output, "w", newline="") as output:
+            write_report(rows, args.format, output)
+    else:
+        write_report(rows, args.format, sys.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--since", help="only jobs created within e.g. 2w, 90d")
+    parser.add_argument("-r", "--report", choices=REPORTS, default="top")
+    parser.add_argument("--top", type=int, default=20, help="rows of top report")
+    parser.add_argument("-f", "--format", choices=["table", "csv", "json"], default="table")
+    parser.add_argument("-o", "--output", help="write report to file instead of stdout")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    if args.since:
+        try:
+            JobFilter(f"since={args.since}")
+        except FilterError as error:
+            parser.error(str(error))
+    run_profiled(args, run, args)
 
 
 if __name__ == "__main__":
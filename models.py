@@ -1,19 +1,56 @@
+import sys
+
+
 class JobSQL:
 
-    SELECT_QUERY = "select id, test, result, state, flavor, arch, build, group_id, version, machine from jobs where "
-
-    def __init__(self, raw_job):
-        self.id = raw_job[0]
-        self.name = raw_job[1]
-        self.result = raw_job[2]
-        self.state = raw_job[3]
-        self.flavor = raw_job[4]
-        self.arch = raw_job[5]
-        self.build = raw_job[6]
-        self.groupid = raw_job[7]
-        self.version = raw_job[8]
-        self.machine = raw_job[9]
-        self.pattern = "Job(id: {}, name: {}, result: {}, state: {}, flavor: {}, arch: {}, build: {}, groupid: {}, version: {}, machine: {})"
+    COLUMNS = "id, test, result, state, flavor, arch, build, group_id, version, machine"
+    SELECT_QUERY = f"select {COLUMNS} from jobs where "
+    # columns identifying one scenario, only the newest job per scenario is relevant for review
+    SCENARIO_COLUMNS = "test, arch, flavor, version, machine"
+    pattern = "Job(id: {}, name: {}, result: {}, state: {}, flavor: {}, arch: {}, build: {}, groupid: {}, version: {}, machine: {})"
+
+    # jobs are fetched by hundreds of thousands, so no per-instance __dict__
+    __slots__ = (
+        "id",
+        "name",
+        "result",
+        "state",
+        "flavor",
+        "arch",
+        "build",
+        "groupid",
+        "version",
+        "machine",
+    )
+
+    def __init__(self, raw_job, intern=None):
+        """intern maps repeated values to one shared copy, sys.intern when not given"""
+        intern = intern or _intern
+        job_id, name, result, state, flavor, arch, build, groupid, version, machine = raw_job
+        self.id = job_id
+        self.name = intern(name)
+        self.result = intern(result)
+        self.state = intern(state)
+        self.flavor = intern(flavor)
+        self.arch = intern(arch)
+        self.build = intern(build)
+        self.groupid = groupid
+        self.version = intern(version)
+        self.machine = intern(machine)
+
+    @classmethod
+    def from_rows(cls, rows) -> "list[JobSQL]":
+        """Build jobs straight from cursor rows sharing one copy of every repeated value"""
+        intern = _Shared().__getitem__
+        new = cls.__new__
+        init = cls.__init__
+        jobs = []
+        append = jobs.append
+        for row in rows:
+            job = new(cls)
+            init(job, row, intern)
+            append(job)
+        return jobs
 
     def __str__(self):
         return self.pattern.format(
@@ -30,18 +67,7 @@ class JobSQL:
         )
 
     def __repr__(self) -> str:
-        return self.pattern.format(
-            self.id,
-            self.name,
-            self.result,
-            self.state,
-            self.flavor,
-            self.arch,
-            self.build,
-            self.groupid,
-            self.version,
-            self.machine,
-        )
+        return self.__str__()
 
     def investigate_str(self, failed_modules: list[str]) -> str:
         return "Job(id: {}, flavor: {}, arch: {}, build: {}, version: {}, machine: {}, failed_modules:[{}])".format(
@@ -53,3 +79,15 @@ class JobSQL:
             self.machine,
             str(failed_modules),
         )
+
+
+class _Shared(dict):
+    """Values seen so far, lookup of known value is single dict access done in C"""
+
+    def __missing__(self, value):
+        self[value] = value
+        return value
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
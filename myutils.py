@@ -1,49 +1,168 @@
 import subprocess
 import configparser
-import requests
-import psycopg2
 import logging
-import urllib3
+import time
+import threading
+import atexit
+import weakref
+import itertools
+import fnmatch
+import hashlib
+import os
+import re
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
 from models import JobSQL
+from instrumentation import call_stats
 from datetime import datetime, timedelta
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# psycopg2, requests and friends are imported only by code paths which need them,
+# most of script invocations are short and never touch some of them
+if TYPE_CHECKING:
+    import psycopg2.pool
+    from artifact_cache import ArtifactCache
+    from openqa_client import OpenQAClient
+    from osd_mirror import OSDMirror
+    from call_policy import CallPolicy
+    from bugref_index import BugrefIndex
+
+# bug references openQA recognizes in comments, e.g. bsc#1234 or poo#56789
+BUGREF_PATTERN = re.compile(r"\b(?:bsc|boo|bnc|poo|jsc|gh|kde|fdo|lp|pio|tsc)#[\w/#-]*\w")
+# "in (%s, %s, ...)" of any length is same statement for latency baseline
+PLACEHOLDER_LIST = re.compile(r"%s(?:\s*,\s*%s)+")
+
+CommandResult = namedtuple("CommandResult", ["cmd", "returncode", "stdout", "stderr", "seconds"])
 
 
 class TaskHelper:
 
     OPENQA_URL_BASE = "https://openqa.suse.de/"
+    CONFIG_PATH = "/etc/review.ini"
+    # connections to OSD are shared by all helpers living in the process
+    _osd_pool = None
+    _osd_pool_slots = None
+    # own lock, pool creation holding _osd_pool_lock needs the policy
+    _osd_policy = None
+    _osd_policy_lock = threading.Lock()
+    _osd_pool_lock = threading.Lock()
+    _osd_cursor_ids = itertools.count()
+    # names of statements prepared on every pooled connection, entry goes away with the
+    # connection object so replacement connection never inherits it
+    _osd_prepared = weakref.WeakKeyDictionary()
+    # monotonic time every pooled connection was returned, idle ones are pinged on checkout
+    _osd_returned = weakref.WeakKeyDictionary()
+    # same goes for HTTP session used to talk to openQA
+    _http_client = None
+    _http_client_lock = threading.Lock()
+    _artifact_cache = None
+    # synced mirrors by path, every process syncs mirror only once
+    _mirrors = {}
+    _mirrors_lock = threading.Lock()
 
     def __init__(self, name: str, dryrun: bool, debug: bool = True):
         self.name: str = name
         self.dryrun: bool = dryrun
         self.showsql: bool = False
-        self.config = configparser.ConfigParser()
-        self.config.read("/etc/review.ini")
+        self.query_count: int = 0
+        # when set, OSD queries are answered from local mirror instead of OSD
+        self.mirror: "OSDMirror" = None
+        self._config = None
         self.logger = logging.getLogger(name)
         log_level = logging.INFO
         if debug:
             log_level = logging.DEBUG
         logging.basicConfig(format="%(levelname)s:%(message)s", level=log_level)
-        if self.config.has_section("OSD"):
-            self.osd_username = self.config.get("OSD", "username")
-            self.osd_password = self.config.get("OSD", "password")
-            self.osd_host = self.config.get("OSD", "host")
+
+    @property
+    def config(self) -> configparser.ConfigParser:
+        if self._config is None:
+            self._config = configparser.ConfigParser()
+            self._config.read(self.CONFIG_PATH)
+        return self._config
+
+    def http(self) -> "OpenQAClient":
+        with TaskHelper._http_client_lock:
+            if TaskHelper._http_client is None:
+                from openqa_client import OpenQAClient, read_api_credentials
+                from call_policy import CallPolicy
+
+                apikey, apisecret = read_api_credentials(self.OPENQA_URL_BASE, self.config)
+                logger = logging.getLogger("openqa_client")
+                concurrency = self.config.getint("openQA", "concurrency", fallback=8)
+                TaskHelper._http_client = OpenQAClient(
+                    logger,
+                    concurrency=concurrency,
+                    policy=CallPolicy.from_config(
+                        "openQA",
+                        logger,
+                        self.config,
+                        "openQA",
+                        stats=call_stats,
+                        concurrency=concurrency,
+                        timeouts=OpenQAClient.ENDPOINT_TIMEOUTS,
+                    ),
+                    apikey=apikey,
+                    apisecret=apisecret,
+                    stats=call_stats,
+                )
+                atexit.register(TaskHelper._http_client.close)
+            return TaskHelper._http_client
+
+    def artifact_cache(self) -> "ArtifactCache":
+        with TaskHelper._http_client_lock:
+            if TaskHelper._artifact_cache is None:
+                from artifact_cache import ArtifactCache
+
+                TaskHelper._artifact_cache = ArtifactCache(
+                    os.path.expanduser(
+                        self.config.get("cache", "path", fallback="~/.cache/openqa-review")
+                    ),
+                    self.config.getint("cache", "max_size_mb", fallback=1024) * 2**20,
+                )
+            return TaskHelper._artifact_cache
 
     def request_get(self, url):
-        response = requests.get(url, timeout=200, verify=False)
-        response.raise_for_status()
-        json = response.json()
-        if "error" in json:
-            raise RuntimeError(json)
-        return json
-
-    def get_latest_build(self, job_group_id) -> str:
+        return self.http().get_json(url)
+
+    def request_get_many(self, urls, missing_ok: bool = False) -> list:
+        """Fetch batch of urls concurrently, results are in order of urls"""
+        return self.http().get_json_many(urls, missing_ok)
+
+    def request_iter_many(self, urls, missing_ok: bool = False):
+        """Like request_get_many but yields results while later urls are still fetched"""
+        return self.http().iter_json(urls, missing_ok)
+
+    def request_get_artifact(self, job_id, name: str, url: str, immutable: bool = False):
+        """Fetch per-job artifact through local cache, see OpenQAClient.get_cached_json"""
+        return self.http().get_cached_json(url, self.artifact_cache(), job_id, name, immutable)
+
+    def request_iter_artifacts(self, artifacts, immutable: bool = False, missing_ok: bool = False):
+        """Fetch (job_id, name, url) artifacts concurrently through local cache, yielded in order"""
+        return self.http().iter_cached_json(artifacts, self.artifact_cache(), immutable, missing_ok)
+
+    def request_iter_artifact_items(
+        self, artifacts, key: str, select, immutable: bool = False, missing_ok: bool = False
+    ):
+        """Stream (job_id, name, url) JSON artifacts keeping only select(item) of their key array"""
+        return self.http().iter_cached_items(
+            artifacts, self.artifact_cache(), key, select, immutable, missing_ok
+        )
+
+    def get_group_overview(self, job_group_id) -> dict:
+        return self.request_get(
+            f"{TaskHelper.OPENQA_URL_BASE}group_overview/{job_group_id}.json"
+        )
+
+    def get_child_groups(self, parent_group_id) -> list[int]:
+        groups = self.request_get(f"{TaskHelper.OPENQA_URL_BASE}api/v1/job_groups")
+        return [group["id"] for group in groups if group.get("parent_id") == int(parent_group_id)]
+
+    def get_latest_build(self, job_group_id, group_json: dict = None) -> str:
         build = "1"
         try:
-            group_json = self.request_get(
-                f"{TaskHelper.OPENQA_URL_BASE}group_overview/{job_group_id}.json"
-            )
+            if group_json is None:
+                group_json = self.get_group_overview(job_group_id)
             if len(group_json["build_results"]) == 0:
                 self.logger.warning(f"No jobs found in {job_group_id}")
                 return None
@@ -58,20 +177,154 @@ class TaskHelper:
             return None
         try:
             self.logger.debug(cmd)
-            output = subprocess.check_output(cmd, shell=True)
+            with call_stats.measure("shell_exec"):
+                output = subprocess.check_output(cmd, shell=True)
             self.logger.debug(output)
         except subprocess.CalledProcessError:
             self.logger.error("Command died")
         return None
 
+    def _run_command(self, cmd: str) -> CommandResult:
+        self.logger.debug(cmd)
+        started = time.perf_counter()
+        completed = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        seconds = time.perf_counter() - started
+        call_stats.record("shell_exec", seconds)
+        return CommandResult(cmd, completed.returncode, completed.stdout, completed.stderr, seconds)
+
+    def shell_exec_many(self, cmds, parallelism: int = None) -> list[CommandResult]:
+        """Run commands with bounded parallelism and log ordered report of every result.
+
+        cmds may be lazy iterable, only few commands more than parallelism are taken
+        from it ahead of finished ones. Failure of one command does not stop others,
+        results are in order of cmds.
+        """
+        if self.dryrun:
+            for cmd in cmds:
+                self.logger.debug("NOT EXECUTING - %s", cmd)
+            return []
+        from concurrent.futures import ThreadPoolExecutor
+
+        parallelism = parallelism or self.config.getint("openQA", "clone_parallelism", fallback=4)
+        results = []
+
+        def report(result: CommandResult) -> None:
+            results.append(result)
+            if result.returncode == 0:
+                self.logger.info("[%d] OK in %.1fs: %s", len(results), result.seconds, result.stdout.strip())
+            else:
+                self.logger.error(
+                    "[%d] exit code %d in %.1fs: %s\n%s%s",
+                    len(results),
+                    result.returncode,
+                    result.seconds,
+                    result.cmd,
+                    result.stdout,
+                    result.stderr,
+                )
+
+        with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="shell") as executor:
+            pending = deque()
+            for cmd in cmds:
+                pending.append(executor.submit(self._run_command, cmd))
+                if len(pending) >= parallelism * 2:
+                    report(pending.popleft().result())
+            while pending:
+                report(pending.popleft().result())
+        failed = sum(1 for result in results if result.returncode != 0)
+        self.logger.info("%d commands done, %d failed", len(results), failed)
+        return results
+
+    def api_write_many(self, writes) -> int:
+        """Send (method, path, params) writes to openQA API concurrently.
+
+        writes may be lazy iterable, dispatching starts while it is still produced.
+        Returns number of failed writes.
+        """
+        total = 0
+        failed = 0
+        if self.dryrun:
+            for method, path, params in writes:
+                self.logger.debug("NOT EXECUTING - %s %s %s", method, path, params or "")
+            return 0
+        api_url = f"{self.OPENQA_URL_BASE}api/v1/"
+        for success in self.http().iter_write(
+            (method, f"{api_url}{path}", params) for method, path, params in writes
+        ):
+            total += 1
+            if not success:
+                failed += 1
+        self.logger.debug("%d API writes done, %d failed", total, failed)
+        return failed
+
+    def api_write(self, method: str, path: str, params: dict = None) -> bool:
+        return self.api_write_many([(method, path, params)]) == 0
+
     def add_comment(self, jobid, comment):
+        self.add_comments([jobid], comment)
+
+    def iter_job_comments(self, jobids):
+        """Yield (jobid, comments) fetched concurrently through artifact cache.
+
+        jobids may be lazy iterable, comments of later jobs are fetched while earlier
+        ones are consumed.
+        """
+        requested = deque()
+
+        def artifacts():
+            for jobid in jobids:
+                requested.append(jobid)
+                yield jobid, "comments.json", f"{self.OPENQA_URL_BASE}api/v1/jobs/{jobid}/comments"
+
+        for comments in self.request_iter_artifacts(artifacts(), missing_ok=True):
+            yield requested.popleft(), comments or []
+
+    @staticmethod
+    def has_comment(comments: list, comment: str) -> bool:
+        """True when same text is already there or, for plain bug references, all of them are"""
+        if any(existing["text"].strip() == comment.strip() for existing in comments):
+            return True
+        bugrefs = set(BUGREF_PATTERN.findall(comment))
+        # any other text (labels like label:force_result:, explanations) must not get lost
+        if not bugrefs or BUGREF_PATTERN.sub("", comment).strip():
+            return False
+        existing_bugrefs = {bugref for existing in comments for bugref in existing.get("bugrefs", [])}
+        return bugrefs <= existing_bugrefs
+
+    def add_comments(
+        self, jobids, comment, skip_existing: bool = True, raise_on_failure: bool = False
+    ) -> int:
+        """Comment every job, jobs already carrying the comment are skipped.
+
+        Returns number of comments sent, with raise_on_failure any failed write raises
+        RuntimeError after all writes were dispatched.
+        """
         if comment is None:
             raise AttributeError("Comment is not defined")
-        self.logger.debug(
-            f'Add a comment="{comment}" to {self.OPENQA_URL_BASE}t{jobid}'
+        counts = {"sent": 0, "skipped": 0}
+
+        def comment_writes():
+            if skip_existing:
+                jobs = self.iter_job_comments(jobids)
+            else:
+                jobs = ((jobid, []) for jobid in jobids)
+            for jobid, comments in jobs:
+                if self.has_comment(comments, comment):
+                    counts["skipped"] += 1
+                    continue
+                counts["sent"] += 1
+                self.logger.debug(
+                    f'Add a comment="{comment}" to {self.OPENQA_URL_BASE}t{jobid}'
+                )
+                yield "POST", f"jobs/{jobid}/comments", {"text": comment}
+
+        failed = self.api_write_many(comment_writes())
+        self.logger.info(
+            "%d comments sent, %d skipped as already present", counts["sent"], counts["skipped"]
         )
-        cmd = f"openqa-cli api --host {self.OPENQA_URL_BASE} -X POST jobs/{jobid}/comments text='{comment}'"
-        self.shell_exec(cmd)
+        if failed and raise_on_failure:
+            raise RuntimeError(f"{failed} of {counts['sent']} comments failed")
+        return counts["sent"] - failed
 
     def getJobGroupComments(self, jobgroup: int) -> list[str]:
         self.logger.debug("Fetching comments for job group %d ... ", jobgroup)
@@ -82,39 +335,242 @@ class TaskHelper:
         self.logger.debug("%d comments fetched", len(comments))
         return comments
 
-    def osd_query(self, query: str) -> list:
-        if (
-            hasattr(self, "osd_username")
-            and hasattr(self, "osd_password")
-            and hasattr(self, "osd_host")
-        ):
-            connection = None
-            try:
-                connection = psycopg2.connect(
-                    user=self.osd_username,
-                    password=self.osd_password,
-                    host=self.osd_host,
+    def osd_pool(self) -> "psycopg2.pool.ThreadedConnectionPool":
+        with TaskHelper._osd_pool_lock:
+            if TaskHelper._osd_pool is None:
+                import psycopg2.pool
+
+                pool_size = self.config.getint("OSD", "pool_size", fallback=4)
+                TaskHelper._osd_pool = psycopg2.pool.ThreadedConnectionPool(
+                    0,
+                    pool_size,
+                    user=self.config.get("OSD", "username"),
+                    password=self.config.get("OSD", "password"),
+                    host=self.config.get("OSD", "host"),
                     port="5432",
                     database="openqa",
+                    connect_timeout=10,
+                    # server cancels queries running longer than OSD policy timeout
+                    options=f"-c statement_timeout={int(self.osd_policy().default_timeout * 1000)}",
+                )
+                # minconn=0 above makes pool close every returned connection, raising it
+                # after construction keeps connections (and statements prepared on them)
+                # for reuse without opening all of them upfront
+                TaskHelper._osd_pool.minconn = pool_size
+                # ThreadedConnectionPool raises instead of waiting when exhausted
+                TaskHelper._osd_pool_slots = threading.BoundedSemaphore(pool_size)
+                atexit.register(TaskHelper.close_osd_pool)
+            return TaskHelper._osd_pool
+
+    def osd_policy(self) -> "CallPolicy":
+        """Rate limit, adaptive concurrency and retries of OSD queries, see [OSD] section"""
+        with TaskHelper._osd_policy_lock:
+            if TaskHelper._osd_policy is None:
+                from call_policy import CallPolicy
+
+                TaskHelper._osd_policy = CallPolicy.from_config(
+                    "OSD",
+                    logging.getLogger("osd"),
+                    self.config,
+                    "OSD",
+                    stats=call_stats,
+                    concurrency=self.config.getint("OSD", "pool_size", fallback=4),
+                    retries=3,
+                    timeout=300,
                 )
-                cursor = connection.cursor()
-                if self.showsql:
-                    self.logger.debug(query)
-                cursor.execute(query)
-                return cursor.fetchall()
-            except (Exception, psycopg2.Error) as error:
-                self.logger.error(error)
+            return TaskHelper._osd_policy
+
+    @staticmethod
+    def _osd_transient(error) -> bool:
+        """Lost connection, too many clients, server restart or serialization failure"""
+        import psycopg2.errors
+
+        return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError)) and not isinstance(
+            error, psycopg2.errors.QueryCanceled
+        )
+
+    @staticmethod
+    def close_osd_pool() -> None:
+        with TaskHelper._osd_pool_lock:
+            if TaskHelper._osd_pool is not None:
+                TaskHelper._osd_pool.closeall()
+                TaskHelper._osd_pool = None
+                TaskHelper._osd_prepared.clear()
+
+    def osd_configured(self) -> bool:
+        return all(
+            self.config.has_option("OSD", option) for option in ("username", "password", "host")
+        )
+
+    @contextmanager
+    def osd_connection(self):
+        if not self.osd_configured():
+            raise AttributeError("Connection to osd is not defined ")
+        import psycopg2.extensions
+
+        pool = self.osd_pool()
+        ping_idle = self.config.getfloat("OSD", "ping_idle", fallback=30)
+        with TaskHelper._osd_pool_slots:
+            connection = pool.getconn()
+            # closed or broken connection is replaced, one idle long enough to be dropped by
+            # server or firewall is pinged first as client side state does not show that
+            while (
+                connection.closed
+                or connection.info.transaction_status
+                == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+                or not self._osd_alive(connection, ping_idle)
+            ):
+                pool.putconn(connection, close=True)
+                connection = pool.getconn()
+            broken = False
+            try:
+                yield connection
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
             finally:
-                if connection is not None:
-                    cursor.close()
-                    connection.close()
+                TaskHelper._osd_returned[connection] = time.monotonic()
+                pool.putconn(connection, close=broken or bool(connection.closed))
+
+    @staticmethod
+    def _osd_alive(connection, ping_idle: float) -> bool:
+        """False when connection idle for more than ping_idle seconds does not answer"""
+        import psycopg2
+
+        returned = TaskHelper._osd_returned.get(connection)
+        # fresh connection was just opened
+        if returned is None or time.monotonic() - returned <= ping_idle:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("select 1")
+            connection.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def osd_query(self, query: str, params=None, prepared: bool = False) -> list:
+        """Run query with %s placeholders bound to params.
+
+        prepared=True makes OSD plan query once per connection, use it for queries
+        which are repeated with different params.
+        """
+        if self.mirror is not None:
+            self.query_count += 1
+            if self.showsql:
+                self.logger.debug("%s %s", query, params or "")
+            with call_stats.measure("mirror_query"):
+                return self.mirror.query(query, params)
+        return self.osd_query_remote(query, params, prepared)
+
+    def osd_query_remote(self, query: str, params=None, prepared: bool = False) -> list:
+        """Run query on OSD retrying transient failures.
+
+        Error left after last retry is raised, empty result would look like no jobs.
+        """
+        if not self.osd_configured():
+            raise AttributeError("Connection to osd is not defined ")
+        policy = self.osd_policy()
+        for attempt in policy.attempts("OSD query"):
+            with policy.slot("query", self.osd_statement_class(query)) as call:
+                try:
+                    with self.osd_connection() as connection:
+                        with connection.cursor() as cursor:
+                            self.query_count += 1
+                            if self.showsql:
+                                self.logger.debug("%s %s", query, params or "")
+                            with call_stats.measure("osd_query"):
+                                if prepared:
+                                    self._execute_prepared(connection, cursor, query, params or [])
+                                else:
+                                    cursor.execute(query, params or None)
+                                return cursor.fetchall()
+                except Exception as error:
+                    if attempt.last or not self._osd_transient(error):
+                        raise
+                    call.overloaded = True
+                    attempt.failed(error)
+
+    @staticmethod
+    def osd_statement_class(query: str) -> str:
+        """Latency class of query, quick lookups and big reports must not share one baseline"""
+        statement = PLACEHOLDER_LIST.sub("%s", query)
+        return f"query {hashlib.sha1(statement.encode()).hexdigest()[:16]}"
+
+    @staticmethod
+    def _execute_prepared(connection, cursor, query: str, params) -> None:
+        statement = f"review_{hashlib.sha1(query.encode()).hexdigest()[:16]}"
+        prepared = TaskHelper._osd_prepared.setdefault(connection, set())
+        if statement not in prepared:
+            parts = query.split("%s")
+            numbered = parts[0] + "".join(f"${i}{part}" for i, part in enumerate(parts[1:], 1))
+            cursor.execute(f"PREPARE {statement} AS {numbered.replace('%%', '%')}")
+            prepared.add(statement)
+        if params:
+            cursor.execute(f"EXECUTE {statement} ({', '.join(['%s'] * len(params))})", params)
         else:
+            cursor.execute(f"EXECUTE {statement}")
+
+    def osd_explain(self, query: str, params=None) -> list[str]:
+        """Plan which OSD (or local mirror) would use for query, one line per plan node"""
+        if self.mirror is not None:
+            return [row[-1] for row in self.mirror.query(f"EXPLAIN QUERY PLAN {query}", params)]
+        return [row[0] for row in self.osd_query_remote(f"EXPLAIN {query}", params)]
+
+    def osd_iter_query(self, query: str, fetch_size: int = None, params=None):
+        if self.mirror is not None:
+            return iter(self.osd_query(query, params))
+        return self.osd_iter_query_remote(query, fetch_size, params)
+
+    def osd_iter_query_remote(self, query: str, fetch_size: int = None, params=None):
+        """Yield rows of query while they arrive using server side cursor.
+
+        Connection stays checked out from the pool until generator is exhausted or closed.
+        Transient failures are retried only until first row is yielded, any other error
+        is raised to the consumer.
+        """
+        if not self.osd_configured():
             raise AttributeError("Connection to osd is not defined ")
+        policy = self.osd_policy()
+        yielded = False
+        for attempt in policy.attempts("OSD streaming query"):
+            policy.throttle()
+            try:
+                with self.osd_connection() as connection:
+                    cursor_name = f"{self.name}_{next(TaskHelper._osd_cursor_ids)}"
+                    with connection.cursor(name=cursor_name) as cursor:
+                        fetch_size = fetch_size or self.config.getint("OSD", "fetch_size", fallback=2000)
+                        self.query_count += 1
+                        if self.showsql:
+                            self.logger.debug("%s %s", query, params or "")
+                        # DECLARE can not run EXECUTE, values are bound by psycopg2 here
+                        cursor.execute(query, params or None)
+                        while True:
+                            # time spent by consumer between batches is not OSD time
+                            with call_stats.measure("osd_fetch"):
+                                rows = cursor.fetchmany(fetch_size)
+                            if not rows:
+                                break
+                            yielded = True
+                            yield from rows
+                return
+            except Exception as error:
+                if yielded or attempt.last or not self._osd_transient(error):
+                    raise
+                attempt.failed(error)
+
+
+def modules_match(modules, module_filter: str) -> bool:
+    """True when any module name equals module_filter or matches it as glob pattern"""
+    return any(fnmatch.fnmatchcase(module, module_filter) for module in modules)
 
 
 class JobsList:
 
-    def __init__(self) -> None:
+    def __init__(self, keep_jobs: bool = True) -> None:
+        # streaming consumers only need statistics, jobs itself are not stored
+        self.keep_jobs = keep_jobs
+        self.count = 0
         self.jobs = []
         self.job_stat = {
             "names": set(),
@@ -130,7 +586,9 @@ class JobsList:
         self.job_stat["arches"].add(job.arch)
         self.job_stat["versions"].add(job.version)
         self.job_stat["machines"].add(job.machine)
-        self.jobs.append(job)
+        self.count += 1
+        if self.keep_jobs:
+            self.jobs.append(job)
 
     def log(self, logger):
         if len(self.job_stat) > 0:
@@ -148,6 +606,9 @@ class JobsList:
 
 class openQAHelper(TaskHelper):
 
+    FAILED_RESULTS = ("failed", "timeout_exceeded", "incomplete")
+    PASSED_RESULTS = ("passed", "softfailed")
+
     def __init__(
         self,
         name: str,
@@ -157,14 +618,63 @@ class openQAHelper(TaskHelper):
         debug: bool = True,
     ):
         super(openQAHelper, self).__init__(name, dryrun, debug=debug)
-        time_str = str(datetime.now() - timedelta(weeks=not_older_than_weeks))
-        self.SQL_WHERE_RESULTS = f" and result in ('failed', 'timeout_exceeded', 'incomplete') and t_created > '{time_str}'::date"
+        # plain date literal is understood both by OSD and local mirror
+        time_str = str((datetime.now() - timedelta(weeks=not_older_than_weeks)).date())
+        self.SQL_WHERE_RESULTS = f" and result in ('failed', 'timeout_exceeded', 'incomplete') and t_created > '{time_str}'"
         self.groupid = groupid
+        self._bugref_index = None
+
+    @property
+    def mirror(self) -> "OSDMirror":
+        """Local mirror answering OSD queries, with [mirror] enabled it is synced on first use.
+
+        Config is not read before, so constructing helper stays cheap.
+        """
+        if not self._mirror_checked:
+            self._mirror_checked = True
+            if self.config.getboolean("mirror", "enabled", fallback=False):
+                self.use_mirror()
+        return self._mirror
+
+    @mirror.setter
+    def mirror(self, mirror: "OSDMirror") -> None:
+        self._mirror_checked = mirror is not None
+        self._mirror = mirror
+
+    def use_mirror(self) -> None:
+        """Sync local mirror of OSD and answer all following queries from it"""
+        path = os.path.expanduser(
+            self.config.get("mirror", "path", fallback="~/.cache/openqa-review/osd_mirror.sqlite")
+        )
+        with TaskHelper._mirrors_lock:
+            if path not in TaskHelper._mirrors:
+                from osd_mirror import OSDMirror
+
+                mirror = OSDMirror(path, self.logger, self.config.getint("mirror", "weeks", fallback=8))
+                mirror.sync(self.osd_iter_query_remote)
+                TaskHelper._mirrors[path] = mirror
+            self.mirror = TaskHelper._mirrors[path]
+
+    def bugref_index(self) -> "BugrefIndex":
+        """Local index of bug references in job comments, see bugref_index.py"""
+        if self._bugref_index is None:
+            from bugref_index import BugrefIndex
+
+            self._bugref_index = BugrefIndex(
+                os.path.expanduser(
+                    self.config.get("bugref_index", "path", fallback="~/.cache/openqa-review/bugref_index.sqlite")
+                ),
+                self.logger,
+                self.config.getint("bugref_index", "weeks", fallback=8),
+            )
+        return self._bugref_index
 
-    def find_latest_query(self, latest_build: str, job: JobSQL):
-        FIND_LATEST = "select max(id) from jobs where  build='{}' and group_id='{}'  and test='{}' and arch='{}' \
-        and flavor='{}' and version='{}' and machine='{}';"
-        return FIND_LATEST.format(
+    def find_latest_query(self, latest_build: str, job: JobSQL) -> tuple[str, list]:
+        FIND_LATEST = (
+            "select max(id) from jobs where build=%s and group_id=%s and test=%s and arch=%s "
+            "and flavor=%s and version=%s and machine=%s"
+        )
+        return FIND_LATEST, [
             latest_build,
             self.groupid,
             job.name,
@@ -172,28 +682,89 @@ class openQAHelper(TaskHelper):
             job.flavor,
             job.version,
             job.machine,
+        ]
+
+    def latest_jobs_query(self, latest_build: str) -> tuple[str, list]:
+        return (
+            f"select {JobSQL.COLUMNS} from (select {JobSQL.COLUMNS}, row_number() over "
+            f"(partition by {JobSQL.SCENARIO_COLUMNS} order by id desc) as latest from jobs "
+            f"where group_id=%s and build=%s) as scenarios where latest=1 order by id",
+            [self.groupid, latest_build],
         )
 
-    def osd_get_jobs_where(self, latest_build: str) -> list[JobSQL]:
+    def osd_get_jobs_where(self, latest_build: str, per_job_lookup: bool = False) -> list[JobSQL]:
         jobs = JobsList()
-        query = f"{JobSQL.SELECT_QUERY} group_id='{self.groupid}' and build='{latest_build}' "
-        rezult = self.osd_query(query)
-        if rezult:
-            for raw_job in rezult:
-                sql_job = JobSQL(raw_job)
-                rez = self.osd_query(self.find_latest_query(latest_build, sql_job))
-                if rez[0][0] == sql_job.id:
+        started = time.monotonic()
+        queries_before = self.query_count
+        if per_job_lookup:
+            # legacy path: one max(id) lookup per returned job
+            query = f"{JobSQL.SELECT_QUERY} group_id=%s and build=%s"
+            rezult = self.osd_query(query, [self.groupid, latest_build])
+            if rezult:
+                for raw_job in rezult:
+                    sql_job = JobSQL(raw_job)
+                    rez = self.osd_query(*self.find_latest_query(latest_build, sql_job), prepared=True)
+                    if rez and rez[0][0] == sql_job.id:
+                        jobs.append(sql_job)
+        else:
+            rezult = self.osd_query(*self.latest_jobs_query(latest_build), prepared=True)
+            if rezult:
+                for sql_job in JobSQL.from_rows(rezult):
                     jobs.append(sql_job)
+        self.logger.info(
+            "Latest jobs for build %s (%s): %d jobs, %d queries in %.2fs",
+            latest_build,
+            "per-job lookup" if per_job_lookup else "single query",
+            len(jobs.jobs),
+            self.query_count - queries_before,
+            time.monotonic() - started,
+        )
+        if jobs.jobs:
             jobs.log(self.logger)
         return jobs.jobs
 
-    def osd_get_all_jobs(self, extra_conditions : str = "", display_summary : bool = True) -> list[JobSQL]:
+    def all_jobs_query(self, extra_conditions: str = "", params=None) -> tuple[str, list]:
+        return f"{JobSQL.SELECT_QUERY} group_id=%s {extra_conditions}", [self.groupid, *(params or [])]
+
+    def osd_get_all_jobs(
+        self, extra_conditions: str = "", display_summary: bool = True, params=None
+    ) -> list[JobSQL]:
         jobs = JobsList()
-        query = f"{JobSQL.SELECT_QUERY} group_id='{self.groupid}' {extra_conditions}"
-        rezult = self.osd_query(query)
+        rezult = self.osd_query(*self.all_jobs_query(extra_conditions, params))
         if rezult:
-            for raw_job in rezult:
-                jobs.append(JobSQL(raw_job))
+            for sql_job in JobSQL.from_rows(rezult):
+                jobs.append(sql_job)
             if display_summary:
                 jobs.log(self.logger)
         return jobs.jobs
+
+    def osd_get_failed_modules(self, job_ids, chunk_size: int = 1000) -> dict[int, set[str]]:
+        """Map every job id to set of its failed modules using one query per chunk of ids"""
+        failed_modules = {job_id: set() for job_id in job_ids}
+        ids = list(failed_modules)
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start : start + chunk_size]
+            # full chunks share the same statement
+            rezult = self.osd_query(
+                "select job_id, name from job_modules where job_id in "
+                f"({', '.join(['%s'] * len(chunk))}) and result='failed'",
+                chunk,
+                prepared=True,
+            )
+            for job_id, name in rezult:
+                failed_modules[job_id].add(name)
+        return failed_modules
+
+    def osd_iter_all_jobs(
+        self, extra_conditions: str = "", jobs: JobsList = None, fetch_size: int = None, params=None
+    ):
+        """Same as osd_get_all_jobs but yields jobs while rows are still fetched.
+
+        When jobs is given its statistics are updated with every yielded job.
+        """
+        query, params = self.all_jobs_query(extra_conditions, params)
+        for raw_job in self.osd_iter_query(query, fetch_size, params):
+            job = JobSQL(raw_job)
+            if jobs is not None:
+                jobs.append(job)
+            yield job
@@ -0,0 +1,351 @@
+import collections
+import configparser
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from json_stream import iter_array_items, iter_file_chunks
+from call_policy import CallPolicy
+
+# openQA instances are accessed without certificate verification
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+
+CLIENT_CONF_PATHS = ["/etc/openqa/client.conf", os.path.expanduser("~/.config/openqa/client.conf")]
+
+
+def read_api_credentials(host_url: str, config: configparser.ConfigParser = None):
+    """Return (key, secret) for openQA host the same way openqa-cli finds them.
+
+    client.conf sections are named by host, the openQA section of review.ini is fallback.
+    """
+    client_conf = configparser.ConfigParser()
+    client_conf.read(CLIENT_CONF_PATHS)
+    host = urlparse(host_url).netloc or host_url
+    if client_conf.has_option(host, "key") and client_conf.has_option(host, "secret"):
+        return client_conf.get(host, "key"), client_conf.get(host, "secret")
+    if config is not None and config.has_option("openQA", "key"):
+        return config.get("openQA", "key"), config.get("openQA", "secret")
+    return None, None
+
+
+class OpenQAClient:
+    """HTTP client for openQA sharing one keep-alive session between all calls.
+
+    Batches of URLs are fetched by a bounded thread pool and returned in the order of
+    the URLs given. Writes are signed with API key/secret like openqa-cli does.
+    """
+
+    # bytes read from streamed response body at once
+    STREAM_CHUNK = 2**16
+    # server is busy or restarting, request was not processed
+    RETRY_STATUSES = (429, 503)
+    # gateway errors may come after request was processed, retried only when repeating is safe
+    RETRY_IDEMPOTENT_STATUSES = (429, 502, 503, 504)
+    IDEMPOTENT_METHODS = ("GET", "DELETE")
+    # seconds per endpoint path, first matching pattern wins, others use policy timeout
+    ENDPOINT_TIMEOUTS = [
+        ("*/comments*", 30),
+        ("/group_overview/*", 60),
+        ("/api/v1/jobs*", 60),
+        ("/tests/*/file/*", 120),
+    ]
+
+    def __init__(
+        self,
+        logger,
+        concurrency: int = 8,
+        policy: CallPolicy = None,
+        apikey: str = None,
+        apisecret: str = None,
+        stats=None,
+    ):
+        self.logger = logger
+        # optional instrumentation.CallStats receiving latency of every request
+        self.stats = stats
+        self.concurrency = concurrency
+        # rate limit, adaptive concurrency below pool size, retries and timeouts
+        self.policy = policy or CallPolicy(
+            "openQA", logger, concurrency=concurrency, timeouts=self.ENDPOINT_TIMEOUTS, stats=stats
+        )
+        self.apikey = apikey
+        self.apisecret = apisecret
+        self.session = requests.Session()
+        self.session.verify = False
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.concurrency, thread_name_prefix="openqa"
+                )
+            return self._executor
+
+    def _call(self, method: str, url: str, send) -> requests.Response:
+        """Call send(timeout) under call policy, retrying when server pushes back.
+
+        Connection errors and timeouts are retried only for idempotent methods, except
+        connect timeout which means request never reached the server.
+        """
+        endpoint = urlparse(url).path
+        idempotent = method in self.IDEMPOTENT_METHODS
+        retry_statuses = self.RETRY_IDEMPOTENT_STATUSES if idempotent else self.RETRY_STATUSES
+        started = time.monotonic()
+        try:
+            for attempt in self.policy.attempts(f"{method} {url}"):
+                with self.policy.slot(endpoint) as call:
+                    try:
+                        response = send(self.policy.timeout(endpoint))
+                    except (requests.ConnectionError, requests.Timeout) as error:
+                        call.overloaded = True
+                        if attempt.last or not (idempotent or isinstance(error, requests.ConnectTimeout)):
+                            raise
+                        attempt.failed(error)
+                        continue
+                    if response.status_code in retry_statuses and not attempt.last:
+                        call.overloaded = True
+                        attempt.failed(f"HTTP {response.status_code}", self._retry_after(response))
+                        response.close()
+                        continue
+                    return response
+        finally:
+            self._record(f"http {method}", time.monotonic() - started)
+
+    @staticmethod
+    def _retry_after(response: requests.Response):
+        try:
+            return float(response.headers["Retry-After"])
+        except (KeyError, ValueError):
+            return None
+
+    def _get(self, url: str, headers: dict = None, stream: bool = False) -> requests.Response:
+        started = time.monotonic()
+        response = self._call(
+            "GET",
+            url,
+            lambda timeout: self.session.get(url, timeout=timeout, headers=headers, stream=stream),
+        )
+        self.logger.debug(
+            "GET %s %d %.3fs", url, response.status_code, time.monotonic() - started
+        )
+        return response
+
+    def _record(self, name: str, seconds: float) -> None:
+        if self.stats is not None:
+            self.stats.record(name, seconds)
+
+    @staticmethod
+    def _decode(response: requests.Response):
+        response.raise_for_status()
+        data = response.json()
+        if "error" in data:
+            raise RuntimeError(data)
+        return data
+
+    def get_json(self, url: str, missing_ok: bool = False):
+        """GET url and return decoded JSON, None for 404 when missing_ok is set"""
+        response = self._get(url)
+        if missing_ok and response.status_code == 404:
+            return None
+        return self._decode(response)
+
+    def get_cached_json(
+        self,
+        url: str,
+        cache,
+        job_id,
+        name: str,
+        immutable: bool = False,
+        missing_ok: bool = False,
+    ):
+        """Same as get_json but going through ArtifactCache entry (job_id, name).
+
+        Immutable artifacts are answered from cache without any request, others are
+        revalidated with conditional request when server gave ETag or Last-Modified.
+        """
+        content, meta = cache.get(job_id, name)
+        if content is not None and immutable:
+            self.logger.debug("CACHED %s", url)
+            return json.loads(content)
+        headers = {}
+        if content is not None:
+            if "etag" in meta:
+                headers["If-None-Match"] = meta["etag"]
+            if "last_modified" in meta:
+                headers["If-Modified-Since"] = meta["last_modified"]
+        response = self._get(url, headers)
+        if response.status_code == 304:
+            return json.loads(content)
+        if missing_ok and response.status_code == 404:
+            return None
+        data = self._decode(response)
+        meta = {}
+        if "ETag" in response.headers:
+            meta["etag"] = response.headers["ETag"]
+        if "Last-Modified" in response.headers:
+            meta["last_modified"] = response.headers["Last-Modified"]
+        cache.put(job_id, name, response.content, meta)
+        return data
+
+    def get_cached_items(
+        self,
+        url: str,
+        cache,
+        job_id,
+        name: str,
+        key: str,
+        select,
+        immutable: bool = False,
+        missing_ok: bool = False,
+    ) -> list:
+        """Stream artifact which is JSON object and collect select(item) of its key array.
+
+        Body is parsed while it arrives and written to cache at the same time, so memory
+        does not depend on artifact size. Items for which select returns None are dropped.
+        Caching rules are the same as for get_cached_json.
+        """
+        cached, meta = cache.open(job_id, name)
+        try:
+            if cached is not None and immutable:
+                self.logger.debug("CACHED %s", url)
+                return self._select_items(iter_file_chunks(cached), key, select)
+            headers = {}
+            if cached is not None:
+                if "etag" in meta:
+                    headers["If-None-Match"] = meta["etag"]
+                if "last_modified" in meta:
+                    headers["If-Modified-Since"] = meta["last_modified"]
+            with self._get(url, headers, stream=True) as response:
+                if response.status_code == 304:
+                    return self._select_items(iter_file_chunks(cached), key, select)
+                if missing_ok and response.status_code == 404:
+                    return None
+                response.raise_for_status()
+                meta = {}
+                if "ETag" in response.headers:
+                    meta["etag"] = response.headers["ETag"]
+                if "Last-Modified" in response.headers:
+                    meta["last_modified"] = response.headers["Last-Modified"]
+                with cache.writer(job_id, name, meta) as content_file:
+                    chunks = self._tee(response.iter_content(self.STREAM_CHUNK), content_file)
+                    selected = self._select_items(chunks, key, select)
+                    # rest of body after the array still belongs to cached artifact
+                    collections.deque(chunks, maxlen=0)
+                return selected
+        finally:
+            if cached is not None:
+                cached.close()
+
+    @staticmethod
+    def _tee(chunks, content_file):
+        for chunk in chunks:
+            content_file.write(chunk)
+            yield chunk
+
+    @staticmethod
+    def _select_items(chunks, key: str, select) -> list:
+        selected = []
+        for item in iter_array_items(chunks, key):
+            value = select(item)
+            if value is not None:
+                selected.append(value)
+        return selected
+
+    def _iter_submitted(self, func, calls):
+        """Run func for every argument tuple of calls in the pool, yield results in order"""
+        pending = collections.deque()
+        for call_args in calls:
+            pending.append(self.executor.submit(func, *call_args))
+            # keep limited number of results waiting for slow consumer
+            if len(pending) >= self.concurrency * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def iter_json(self, urls, missing_ok: bool = False):
+        """Yield get_json results in order of urls while later ones are still in flight"""
+        return self._iter_submitted(self.get_json, ((url, missing_ok) for url in urls))
+
+    def get_json_many(self, urls, missing_ok: bool = False) -> list:
+        return list(self.iter_json(urls, missing_ok))
+
+    def iter_cached_json(self, artifacts, cache, immutable: bool = False, missing_ok: bool = False):
+        """Yield get_cached_json results for (job_id, name, url) artifacts in their order"""
+        return self._iter_submitted(
+            self.get_cached_json,
+            (
+                (url, cache, job_id, name, immutable, missing_ok)
+                for job_id, name, url in artifacts
+            ),
+        )
+
+    def iter_cached_items(
+        self, artifacts, cache, key: str, select, immutable: bool = False, missing_ok: bool = False
+    ):
+        """Yield get_cached_items results for (job_id, name, url) artifacts in their order"""
+        return self._iter_submitted(
+            self.get_cached_items,
+            (
+                (url, cache, job_id, name, key, select, immutable, missing_ok)
+                for job_id, name, url in artifacts
+            ),
+        )
+
+    def _sign(self, request: requests.PreparedRequest) -> None:
+        if not self.apikey:
+            return
+        timestamp = str(time.time())
+        # openQA hashes path the way Mojo::URL renders it
+        path = request.path_url.replace("%20", "+").replace("~", "%7E")
+        request.headers["X-API-Key"] = self.apikey
+        request.headers["X-API-Microtime"] = timestamp
+        request.headers["X-API-Hash"] = hmac.new(
+            self.apisecret.encode(), f"{path}{timestamp}".encode(), hashlib.sha1
+        ).hexdigest()
+
+    def write(self, method: str, url: str, params: dict = None) -> bool:
+        """Send authenticated POST/DELETE, failures are logged and reported as False"""
+        started = time.monotonic()
+
+        def send(timeout):
+            request = self.session.prepare_request(
+                requests.Request(method, url, params=params, headers={"Accept": "application/json"})
+            )
+            # signature carries timestamp, so every retry is signed again
+            self._sign(request)
+            return self.session.send(request, timeout=timeout)
+
+        try:
+            response = self._call(method, url, send)
+            self.logger.debug(
+                "%s %s %d %.3fs", method, url, response.status_code, time.monotonic() - started
+            )
+            response.raise_for_status()
+        except requests.RequestException as error:
+            self.logger.error("%s %s failed - %s", method, url, error)
+            return False
+        return True
+
+    def iter_write(self, writes):
+        """Dispatch (method, url, params) writes concurrently, yield success flags in order"""
+        return self._iter_submitted(self.write, writes)
+
+    def close(self) -> None:
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+        self.session.close()
@@ -0,0 +1,132 @@
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from models import JobSQL
+
+
+class OSDMirror:
+    """Local SQLite copy of jobs and job_modules columns used by review tools.
+
+    Mirror is synced incrementally: jobs with id above highest id seen so far are added,
+    jobs which were not finished on previous sync are refreshed and their modules are
+    copied once they reach final state. Queries written for OSD run unchanged as long as
+    they stick to SQL understood by both PostgreSQL and SQLite.
+    """
+
+    FINAL_STATES = ("done", "cancelled")
+    SYNC_COLUMNS = f"{JobSQL.COLUMNS}, t_created"
+    PLACEHOLDER = re.compile(r"%([s%])")
+
+    def __init__(self, path: str, logger, not_older_than_weeks: int = 8):
+        self.path = path
+        self.logger = logger
+        self.not_older_than_weeks = not_older_than_weeks
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(
+            """
+            create table if not exists jobs (
+                id integer primary key, test text, result text, state text, flavor text,
+                arch text, build text, group_id integer, version text, machine text,
+                t_created text
+            );
+            create index if not exists jobs_group_build on jobs (group_id, build);
+            create index if not exists jobs_state on jobs (state);
+            create table if not exists job_modules (
+                job_id integer, name text, result text, primary key (job_id, name)
+            );
+            create table if not exists sync_state (key text primary key, value integer);
+            """
+        )
+
+    def last_seen(self) -> int:
+        rez = self.connection.execute("select value from sync_state where key='last_seen'").fetchone()
+        return rez[0] if rez else 0
+
+    def sync(self, iter_remote, chunk_size: int = 1000) -> None:
+        """Bring mirror up to date, iter_remote(query) yields rows from OSD.
+
+        iter_remote must raise when query fails, sync is then rolled back as whole. Jobs
+        stored as finished without their modules would never get them.
+        """
+        horizon = str((datetime.now() - timedelta(weeks=self.not_older_than_weeks)).date())
+        with self._lock:
+            try:
+                last_seen = self.last_seen()
+                unfinished = [
+                    row[0]
+                    for row in self.connection.execute(
+                        f"select id from jobs where state not in {self.FINAL_STATES}"
+                    )
+                ]
+                query = f"select {self.SYNC_COLUMNS} from jobs where id > {last_seen}"
+                if last_seen == 0:
+                    query += f" and t_created > '{horizon}'"
+                # ordered so interrupted sync never leaves gap below stored high-water mark
+                query += " order by id"
+                added, finished = self._store_jobs(iter_remote(query))
+                refreshed = 0
+                for start in range(0, len(unfinished), chunk_size):
+                    ids_str = ",".join(str(job_id) for job_id in unfinished[start : start + chunk_size])
+                    count, now_finished = self._store_jobs(
+                        iter_remote(f"select {self.SYNC_COLUMNS} from jobs where id in ({ids_str})")
+                    )
+                    refreshed += count
+                    finished.extend(now_finished)
+                for start in range(0, len(finished), chunk_size):
+                    ids_str = ",".join(str(job_id) for job_id in finished[start : start + chunk_size])
+                    self.connection.executemany(
+                        "insert or replace into job_modules values (?, ?, ?)",
+                        iter_remote(
+                            f"select job_id, name, result from job_modules where job_id in ({ids_str})"
+                        ),
+                    )
+                self.connection.execute("delete from jobs where t_created < ?", (horizon,))
+                self.connection.execute(
+                    "delete from job_modules where job_id not in (select id from jobs)"
+                )
+            except Exception:
+                self.connection.rollback()
+                raise
+            self.connection.commit()
+        self.logger.info(
+            "Mirror %s synced: %d new jobs, %d unfinished refreshed, modules of %d finished jobs copied",
+            self.path,
+            added,
+            refreshed,
+            len(finished),
+        )
+
+    def _store_jobs(self, rows):
+        """Upsert job rows, return their count and ids of jobs in final state"""
+        count = 0
+        finished = []
+        highest = self.last_seen()
+        for row in rows:
+            # psycopg2 gives datetime, SQLite keeps ISO string which compares the same way
+            self.connection.execute(
+                "insert or replace into jobs values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (*row[:-1], str(row[-1])),
+            )
+            if row[3] in self.FINAL_STATES:
+                finished.append(row[0])
+            highest = max(highest, row[0])
+            count += 1
+        self.connection.execute(
+            "insert or replace into sync_state values ('last_seen', ?)", (highest,)
+        )
+        return count, finished
+
+    def query(self, query: str, params=None) -> list:
+        """Run query written for psycopg2, %s placeholders become SQLite ones"""
+        if params:
+            # same as psycopg2: %s is placeholder and %% literal %
+            query = self.PLACEHOLDER.sub(lambda m: "?" if m.group(1) == "s" else "%", query)
+        with self._lock:
+            return self.connection.execute(query, params or ()).fetchall()
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+import argparse
+import json
+import os
+import time
+from myutils import openQAHelper, modules_match
+from models import JobSQL
+from instrumentation import add_profile_arguments, run_profiled
+
+
+class LabelRule:
+    """[rule:<name>] section of /etc/review.ini: comment jobs of groups where module failed"""
+
+    def __init__(self, name: str, groups: list[int], module_filter: str, comment: str):
+        self.name = name
+        self.groups = groups
+        self.module_filter = module_filter
+        self.comment = comment
+
+    def matches(self, job: JobSQL, failed_modules: set) -> bool:
+        return job.groupid in self.groups and modules_match(failed_modules, self.module_filter)
+
+
+class ReviewDaemon(openQAHelper):
+    """Resident labeler reacting only to jobs finished since last checkpoint.
+
+    Checkpoint is highest job id seen plus ids of jobs which were still running at that
+    time, so every job is looked at exactly once when it finishes. Connections, HTTP
+    session and mirror stay warm between cycles.
+    """
+
+    def __init__(self, dryrun: bool = False):
+        super(ReviewDaemon, self).__init__("daemon", None, 1, dryrun)
+        self.rules = [
+            LabelRule(
+                section.split(":", 1)[1],
+                [int(group) for group in self.config.get(section, "groups").split(",")],
+                self.config.get(section, "module"),
+                self.config.get(section, "comment"),
+            )
+            for section in self.config.sections()
+            if section.startswith("rule:")
+        ]
+        self.groups = sorted({group for rule in self.rules for group in rule.groups})
+        self.state_path = os.path.expanduser(
+            self.config.get("daemon", "state", fallback="~/.cache/openqa-review/daemon_state.json")
+        )
+        self.interval = self.config.getint("daemon", "interval", fallback=300)
+        self.checkpoint = None
+        self.pending = set()
+        self.load_state()
+
+    def load_state(self) -> None:
+        try:
+            with open(self.state_path) as state_file:
+                state = json.load(state_file)
+            self.checkpoint = state["checkpoint"]
+            self.pending = set(state["pending"])
+        except FileNotFoundError:
+            pass
+
+    def save_state(self) -> None:
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as state_file:
+            json.dump({"checkpoint": self.checkpoint, "pending": sorted(self.pending)}, state_file)
+        os.replace(tmp_path, self.state_path)
+
+    def new_finished_jobs(self) -> list[JobSQL]:
+        # same statement every cycle, planned once per connection
+        candidates = JobSQL.from_rows(
+            self.osd_query(
+                f"{JobSQL.SELECT_QUERY} group_id in ({', '.join(['%s'] * len(self.groups))}) "
+                "and id > %s order by id",
+                [*self.groups, self.checkpoint],
+                prepared=True,
+            )
+        )
+        if self.pending:
+            pending = sorted(self.pending)
+            still_existing = JobSQL.from_rows(
+                self.osd_query(
+                    f"{JobSQL.SELECT_QUERY} id in ({', '.join(['%s'] * len(pending))})", pending
+                )
+            )
+            # jobs deleted meanwhile would wait forever
+            self.pending &= {job.id for job in still_existing}
+            candidates += still_existing
+        finished = []
+        for job in candidates:
+            self.checkpoint = max(self.checkpoint, job.id)
+            if job.state in ("done", "cancelled"):
+                self.pending.discard(job.id)
+                finished.append(job)
+            else:
+                self.pending.add(job.id)
+        return finished
+
+    def cycle(self) -> int:
+        """Label jobs finished since previous cycle, returns number of comments sent"""
+        if self.mirror is not None:
+            self.mirror.sync(self.osd_iter_query_remote)
+        if self.checkpoint is None:
+            # first start only remembers where OSD is now, history is not labeled
+            rez = self.osd_query("select max(id) from jobs")
+            self.checkpoint = rez[0][0] or 0
+            self.save_state()
+            self.logger.info("Starting from job id %d", self.checkpoint)
+            return 0
+        saved = (self.checkpoint, set(self.pending))
+        try:
+            finished = self.new_finished_jobs()
+            failed = [job for job in finished if job.result in self.FAILED_RESULTS]
+            failed_modules = self.osd_get_failed_modules([job.id for job in failed])
+            labeled = 0
+            for rule in self.rules:
+                to_label = [job.id for job in failed if rule.matches(job, failed_modules[job.id])]
+                if to_label:
+                    self.logger.info("Rule %s matched jobs %s", rule.name, to_label)
+                    labeled += self.add_comments(to_label, rule.comment, raise_on_failure=True)
+        except Exception:
+            # failed lookup or comment write repeats the cycle, comments which made it are skipped then
+            self.checkpoint, self.pending = saved
+            raise
+        # saved only after writes are done, crash in between repeats the cycle
+        self.save_state()
+        if self.config.getboolean("bugref_index", "enabled", fallback=False):
+            self.bugref_index().update(
+                self, self.groups, self.config.getint("bugref_index", "refresh_hours", fallback=48)
+            )
+        self.logger.info(
+            "%d jobs finished, %d failed, %d comments, %d jobs still running, checkpoint %d",
+            len(finished),
+            len(failed),
+            labeled,
+            len(self.pending),
+            self.checkpoint,
+        )
+        return labeled
+
+    def run(self, once: bool = False) -> None:
+        if not self.rules:
+            self.logger.warning("No [rule:<name>] sections in config, nothing to do")
+            return
+        while True:
+            started = time.monotonic()
+            try:
+                self.cycle()
+            except Exception:
+                if once:
+                    raise
+                self.logger.exception("Cycle failed, retrying in next one")
+            if once:
+                return
+            time.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Label newly finished failed jobs by rules from /etc/review.ini"
+    )
+    parser.add_argument(
+        "-d",
+        "--dryrun",
+        action="store_true",
+        help="Fake any calls to openQA with log messages",
+    )
+    parser.add_argument(
+        "--once", action="store_true", help="Run single cycle and exit (for cron)"
+    )
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    daemon = ReviewDaemon(args.dryrun)
+    run_profiled(args, daemon.run, args.once)
+
+
+if __name__ == "__main__":
+    main()